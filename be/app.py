@@ -7,6 +7,7 @@ from base import router
 from base.custom_typing import SanicContext
 from base.inspector import CustomInspector
 from component.cache import cache
+from component.compress import static_handler
 from component.context import get_or_init_executor, get_or_init_httpx
 from component.error import BlueprintErrorHandler
 from component.future import TimerManager
@@ -26,7 +27,10 @@ def setup(_app: Sanic):
     _app.config.update(settings.app_config)
     app.extend(config=settings.ext_config)
     if settings.static_root:
-        _app.static("/static", settings.static_root)
+        handler = static_handler(
+            settings.static_root, settings.compress.content_types, settings.compress.static_max_age
+        )
+        _app.add_route(handler, "/static/<path:path>", methods=["GET", "HEAD"], name="static")
     if settings.logger:
         logger.configure(**settings.logger)
     register_tortoise(_app, config=settings.db.model_dump())
@@ -1,9 +1,65 @@
+from copy import deepcopy
+
 from sanic.worker.inspector import Inspector
 
+from component.cache import Cache
+from component.count import CountCache
+from component.metrics import Registry, metrics
+from config import settings
+from services.community.library import LibraryService
+from services.game.transcode import compare_presets
+
 
 class CustomInspector(Inspector):
+    _redis_cache: Cache = None
+
+    @property
+    def _redis(self) -> Cache:
+        """the inspector runs in its own process, so it has its own connection pool,
+        it's created once and shared by all the commands
+        """
+        if self._redis_cache is None:
+            self._redis_cache = Cache().config(deepcopy(settings.caches)).select("redis")
+        return self._redis_cache
+
     async def recover(self):
         """check the status of all server processes. If the status is FAILED or COMPLETED, then restart them"""
         for process_name, info in self._make_safe(dict(self.worker_state)).items():
             if info.get("server") is True and info.get("state") in {"FAILED", "COMPLETED"}:
                 self._publisher.send(process_name)
+
+    async def metrics(self, raw: bool = False):
+        """aggregate the metrics published by all workers
+        :param raw: return the merged snapshot instead of the Prometheus text format
+        """
+        snapshot = await metrics.collect(self._redis)
+        return snapshot if raw else Registry.render(snapshot)
+
+    async def count_invalidate(self, tags: str):
+        """invalidate the cached totals of the paginated queries
+        :param tags: comma separated tags, e.g. notice,cashshop
+        """
+        tags = [tag.strip() for tag in tags.split(",") if tag.strip()]
+        await CountCache(self._redis).invalidate(*tags)
+        return tags
+
+    async def library_refresh(self):
+        """bump the library version after the library data has changed, the check-in item pool
+        of all workers is rebuilt and the cached character equipment expires
+        """
+        return await self._redis.incr(self._redis.build_key(LibraryService.version_key))
+
+    async def render_report(
+        self, sample: str, presets: str = "60:4,80:4,80:6,90:4,100:4:lossless"
+    ):
+        """the size and the encoding latency of an avatar with each WEBP preset
+        :param sample: the path of a PNG avatar
+        :param presets: comma separated quality:method[:lossless]
+        """
+        with open(sample, "rb") as f:
+            data = f.read()
+        parsed = []
+        for preset in presets.split(","):
+            quality, method, *lossless = preset.strip().split(":")
+            parsed.append((int(quality), int(method), bool(lossless)))
+        return compare_presets(data, parsed)
@@ -6,8 +6,13 @@ from aiosmtplib import SMTP
 from motor.motor_asyncio import AsyncIOMotorClient
 from sanic import Sanic
 
+from component.compress import precompress_dir
+from component.jinja import get_or_init_environment, precompile_templates
+from component.logger import logger
+from component.upstream import close_upstreams
 from config import settings
-from services.community.library import LibraryService, LibraryMongo, LibraryRDB
+from services.community.library import LibraryService, LibraryMongo, LibraryRDB, checkin_pool
+from services.game.transcode import close_transcoder
 from services.rpc.service import MagicService
 
 _app = Sanic.get_app(settings.app_name)
@@ -32,6 +37,31 @@ async def ready(app: Sanic, _):
         app.manager.manage("Sanic-Recover", recover, {"t": settings.recover_interval})
 
 
+@_app.main_process_start
+async def precompress_static(app: Sanic, _):
+    """create the .gz/.br siblings of the static files once before the workers start"""
+    conf = settings.compress
+    if settings.static_root and conf.enable and conf.precompress_static:
+        count = precompress_dir(settings.static_root, conf.content_types, conf.min_size)
+        logger.info(f"precompressed {count} static files under {settings.static_root}")
+
+
+@_app.main_process_start
+async def compile_templates(app: Sanic, _):
+    """precompile the templates once, the workers load them from precompiled_dir"""
+    conf = settings.jinja
+    if conf.precompiled_dir:
+        precompile_templates(conf.template_dir, conf.precompiled_dir)
+        logger.info(f"templates compiled into {conf.precompiled_dir}")
+
+
+@_app.before_server_start
+async def init_jinja(app: Sanic, _):
+    """create the shared jinja environment of the worker"""
+    env = get_or_init_environment(**settings.jinja.model_dump())
+    env.globals.update(url_for=app.url_for)
+
+
 @_app.before_server_start
 async def init_service(app: Sanic, loop):
     """initial async service"""
@@ -56,6 +86,34 @@ async def init_service(app: Sanic, loop):
         app.ext.dependency(jwt)
 
 
+@_app.after_server_start
+async def build_checkin_pool(app: Sanic, _):
+    """verify the check-in items against the library before the first check-in"""
+    if settings.mongo_dsn:
+        library = LibraryMongo(app.ctx.mongo, app.ctx.RPC, app.ctx.cache)
+    else:
+        library = LibraryRDB(app.ctx.RPC, app.ctx.cache)
+    try:
+        pool = await checkin_pool.refresh(library)
+    except Exception as e:
+        # the pool is built on the first check-in instead
+        logger.warning(f"failed to build the check-in pool: {e!r}")
+    else:
+        logger.info(f"check-in pool built with {len(pool.documents)} items")
+
+
+@_app.after_server_stop
+async def stop_transcoder(app: Sanic, _):
+    """stop the avatar transcoding pool of the worker"""
+    close_transcoder()
+
+
+@_app.after_server_stop
+async def stop_upstreams(app: Sanic, _):
+    """close the connection pools of the upstream clients"""
+    await close_upstreams()
+
+
 @_app.before_server_stop
 async def close_tasks(app, loop):
     """cancel all tasks in the event loop before the server stops"""
@@ -1,3 +1,4 @@
+import asyncio
 import re
 import time
 from typing import Any
@@ -6,17 +7,54 @@ from urllib.parse import unquote
 
 from loguru import logger
 from sanic import Sanic
+from sanic.models.server_types import ConnInfo
 from sanic.request import Request
 from sanic.response import HTTPResponse
+from sanic.signals import Event
 
 from component.cache import PyObj, cache
+from component.compress import compress, compressible, encoded_etag, negotiate
 from component.context import ctx_user
+from component.metrics import metrics
+from component.response import etag_matches
 from config import settings
 from models.game import IpBans
 from services.account.auth import AuthService
 
 _app = Sanic.get_app(settings.app_name)
 
+http_requests = metrics.counter(
+    "http_requests_total", "Total HTTP requests.", ("route", "method", "status")
+)
+http_latency = metrics.histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency in seconds.",
+    ("route", "method", "status"),
+    buckets=settings.metrics.latency_buckets,
+)
+http_in_flight = metrics.gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.", ("route",)
+)
+http_request_size = metrics.histogram(
+    "http_request_size_bytes",
+    "HTTP request body size in bytes.",
+    ("route", "method"),
+    buckets=settings.metrics.size_buckets,
+)
+http_response_size = metrics.histogram(
+    "http_response_size_bytes",
+    "HTTP response body size in bytes.",
+    ("route", "method", "status"),
+    buckets=settings.metrics.size_buckets,
+)
+
+
+def route_name(request: Request) -> str:
+    """the route name without the app prefix, e.g. v1.CharRankView, render.index"""
+    if request.route is None:
+        return "unmatched"
+    return request.route.name.split(".", 1)[-1]
+
 
 @_app.on_request
 def set_context(request: Request):
@@ -24,6 +62,21 @@ def set_context(request: Request):
     request.ctx.log_time = time.time()
 
 
+@_app.on_request
+def metrics_begin(request: Request):
+    """count the request as in-flight, paired with metrics_end"""
+    if not settings.metrics.enable:
+        return
+    request.ctx.metrics_start = time.perf_counter()
+    route = route_name(request)
+    http_in_flight.inc(route)
+    # the response middleware is skipped when the request is cancelled after its transport has
+    # been closed, e.g. aborted on shutdown, the connection keeps the route until metrics_end
+    # or metrics_abandoned
+    if request.conn_info is not None:
+        request.conn_info.ctx.metrics_in_flight = route
+
+
 @_app.on_request
 async def ip_ban_403(request: Request) -> Any:
     """Access to the webpage from the banned IP in the game is not allowed, return status code 403."""
@@ -75,3 +128,77 @@ def log_middle_res(request: Request, response: HTTPResponse):
         "cost": f"{duration:.3f}s",
     }
     logger.info("\t".join(f"{k}:{v}" for k, v in content.items()))
+
+
+@_app.on_response
+def metrics_end(request: Request, response: HTTPResponse):
+    """record latency, status and payload sizes of the request"""
+    start = getattr(request.ctx, "metrics_start", None)
+    if start is None:
+        return
+    request.ctx.metrics_start = None
+    duration = time.perf_counter() - start
+    route, method, status = route_name(request), request.method, response.status
+    if request.conn_info is not None:
+        request.conn_info.ctx.metrics_in_flight = None
+    http_in_flight.dec(route)
+    http_requests.inc(route, method, status)
+    http_latency.observe(route, method, status, value=duration)
+    http_request_size.observe(route, method, value=len(request.body or b""))
+    # the size of a streamed response is recorded by the stream, see response.ok_stream
+    if not getattr(request.ctx, "streamed", False):
+        http_response_size.observe(route, method, status, value=len(response.body or b""))
+
+
+@_app.signal(Event.HTTP_LIFECYCLE_COMPLETE)
+async def metrics_abandoned(conn_info: ConnInfo):
+    """the connection is closed while a request is in flight, the request has been cancelled"""
+    if route := getattr(conn_info.ctx, "metrics_in_flight", None):
+        conn_info.ctx.metrics_in_flight = None
+        http_in_flight.dec(route)
+
+
+# response middleware run in reverse order of definition,
+# compress_response is defined before conditional_get so that a 304 is never compressed
+@_app.on_response
+async def compress_response(request: Request, response: HTTPResponse):
+    """gzip/brotli negotiation for the compressible responses larger than min_size"""
+    conf = settings.compress
+    body = response.body
+    if not conf.enable or response.status != 200 or not body or len(body) < conf.min_size:
+        return
+    if "content-encoding" in response.headers:
+        return
+    content_type = response.headers.get("content-type") or response.content_type
+    if not compressible(content_type, conf.content_types):
+        return
+    vary = response.headers.get("vary")
+    if not vary:
+        response.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response.headers["Vary"] = f"{vary}, Accept-Encoding"
+    encoding = negotiate(request.headers.get("accept-encoding"))
+    if encoding is None:
+        return
+    level = conf.brotli_quality if encoding == "br" else conf.gzip_level
+    if len(body) >= conf.offload_size:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(request.app.ctx.executor, compress, body, encoding, level)
+    else:
+        data = compress(body, encoding, level)
+    response.body = data
+    response.headers["Content-Encoding"] = encoding
+    if etag := response.headers.get("etag"):
+        response.headers["ETag"] = encoded_etag(etag, encoding)
+
+
+@_app.on_response
+def conditional_get(request: Request, response: HTTPResponse):
+    """answer 304 Not Modified without a body when If-None-Match matches the ETag"""
+    if request.method not in {HTTPMethod.GET, HTTPMethod.HEAD} or response.status != 200:
+        return
+    etag = response.headers.get("etag")
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        # modify in place, returning a new response would skip the remaining middleware
+        response.status = 304
+        response.body = b""
@@ -1,8 +1,11 @@
 from sanic import Sanic
 
 from component.future import scheduled
+from component.metrics import metrics
 from config import settings
 from services.account.gtop100 import GTop100Service
+from services.game.leaderboard import Leaderboard
+from services.game.rank import RankService
 
 _app = Sanic.get_app(settings.app_name)
 
@@ -19,5 +22,32 @@ async def gtop_vote(app=None):
     await server.grant_reward()
 
 
+@scheduled(repeat=settings.metrics.flush_interval)
+async def metrics_flush(app=None):
+    """
+    Publish the metrics snapshot of this worker, so that the metrics endpoint
+    and the inspector can aggregate all workers
+    :return:
+    """
+    cache = app.ctx.cache.select("redis")
+    await metrics.push(cache, ttl=settings.metrics.flush_interval * 4)
+
+
+@scheduled(repeat=settings.leaderboard.sync_interval)
+async def leaderboard_sync(app=None):
+    """
+    Sync the character and guild rankings into the redis leaderboards
+    :return:
+    """
+    board = Leaderboard(app.ctx.cache.select("redis"))
+    if await board.acquire(max(settings.leaderboard.sync_interval - 5, 1)):
+        await RankService.sync_leaderboard(settings.leaderboard.full_sync_interval)
+        await RankService.sync_guild_leaderboard(settings.leaderboard.guild_max_age)
+
+
 if not _app.name.startswith("Test"):
     _app.add_task(gtop_vote(_app))
+    if settings.metrics.enable:
+        _app.add_task(metrics_flush(_app))
+    if settings.leaderboard.enable:
+        _app.add_task(leaderboard_sync(_app))
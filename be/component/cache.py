@@ -1,5 +1,7 @@
 """缓存组件
 变更日志
+    2026-10-19
+        1. 增加 Cache.get_many 方法，使用一次MGET批量获取多个key
     2024-03-31
         1. 增加 Cache.cache_fn 函数级缓存装饰器
         2. Cache类支持为key设置前缀字符串
@@ -22,7 +24,7 @@ from collections.abc import Awaitable
 from contextlib import AbstractAsyncContextManager, AbstractContextManager
 from functools import wraps
 from threading import RLock
-from typing import Any, Callable, Dict, Optional, TypeVar, Union
+from typing import Any, Callable, Dict, Iterable, Optional, TypeVar, Union
 
 from redis.asyncio import ConnectionPool, StrictRedis
 from typing_extensions import ParamSpec  # introduced in Python3.10
@@ -429,6 +431,23 @@ class Cache:
             return value
         return self.decode(value, serializer, **kwargs)
 
+    async def get_many(self, names: Iterable[str], serializer=None, **kwargs) -> list[Any]:
+        """批量获取多个key，redis使用一次MGET命令
+        :param names: key列表
+        :param serializer: 使用指定的序列化模块
+        :param kwargs: 传递给序列化方法
+        :return: 与names顺序一致的反序列化对象列表，不存在的key为None
+        """
+        keys = [self.build_key(name) for name in names]
+        if not keys:
+            return []
+        db = self.current_db
+        if isinstance(db, MemoryEngine):
+            values = [await db.get(key) for key in keys]
+        else:
+            values = await db.mget(keys)
+        return [self.decode(v, serializer, **kwargs) if v else None for v in values]
+
     async def set(
         self,
         name: str,
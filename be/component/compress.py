@@ -0,0 +1,209 @@
+"""响应压缩组件
+根据Accept-Encoding协商gzip/brotli编码，并为静态文件预先生成.gz/.br压缩副本
+
+brotli是可选依赖，未安装时只支持gzip
+"""
+
+import gzip
+import mimetypes
+import os
+import zlib
+from email.utils import formatdate
+from pathlib import Path
+from typing import Iterable, Optional
+from urllib.parse import unquote
+
+from sanic import NotFound, Request
+from sanic.exceptions import HeaderNotFound
+from sanic.handlers import ContentRangeHandler
+from sanic.response import file, file_stream, validate_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = (
+    "SUPPORTED_ENCODINGS",
+    "negotiate",
+    "compress",
+    "compressible",
+    "encoded_etag",
+    "StreamCompressor",
+    "precompress_dir",
+    "static_handler",
+)
+
+# ordered by preference
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+STREAM_SIZE = 1024 * 1024
+
+
+def negotiate(accept_encoding: Optional[str], supported: Iterable[str] = SUPPORTED_ENCODINGS):
+    """select the encoding with the highest q-value, ties are broken by server preference
+    :param accept_encoding: the Accept-Encoding request header
+    :param supported: the encodings supported by the server in order of preference
+    :return: the selected encoding, or None means identity
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = 6) -> bytes:
+    """compress data with the encoding, level is the gzip level or the brotli quality"""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StreamCompressor:
+    """incremental compression of a streamed body, every chunk is flushed
+    so that the client can decode the received part
+    """
+
+    def __init__(self, encoding: str, level: int = 6):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=level)
+        else:
+            self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._obj.process(data) + self._obj.flush()
+        return self._obj.compress(data) + self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._obj.finish()
+        return self._obj.flush()
+
+
+def compressible(content_type: Optional[str], policy: Iterable[str]) -> bool:
+    """whether the content type is allowed to be compressed by the policy"""
+    if not content_type:
+        return False
+    return content_type.split(";", 1)[0].strip().lower() in policy
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """a strong ETag must differ between representations, so the encoding is appended"""
+    return f'{etag[:-1]}-{encoding}"' if etag.endswith('"') else etag
+
+
+def precompress_dir(
+    root: str,
+    policy: Iterable[str],
+    min_size: int = 1024,
+    gzip_level: int = 9,
+    brotli_quality: int = 11,
+) -> int:
+    """create .gz/.br siblings for the compressible files under root,
+    existing siblings are rewritten only when the source file is newer
+    :return: the number of files written
+    """
+    policy = set(policy)
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(tuple(SUFFIXES.values())):
+                continue
+            source = Path(dirpath, filename)
+            if not compressible(mimetypes.guess_type(filename)[0], policy):
+                continue
+            stat = source.stat()
+            if stat.st_size < min_size:
+                continue
+            data = None
+            for encoding in SUPPORTED_ENCODINGS:
+                target = source.with_name(filename + SUFFIXES[encoding])
+                if target.exists() and target.stat().st_mtime >= stat.st_mtime:
+                    continue
+                if data is None:
+                    data = source.read_bytes()
+                level = brotli_quality if encoding == "br" else gzip_level
+                tmp = target.with_name(target.name + ".tmp")
+                tmp.write_bytes(compress(data, encoding, level))
+                os.replace(tmp, target)
+                written += 1
+    return written
+
+
+def fresh(target: Path, mtime: float) -> bool:
+    """whether the compressed copy exists and is not older than its source"""
+    try:
+        return target.stat().st_mtime >= mtime
+    except FileNotFoundError:
+        return False
+
+
+def static_handler(root: str, policy: Iterable[str], max_age: int = 3600):
+    """a static file handler which prefers the precompressed variants of the requested file
+    :param root: the static root directory
+    :param policy: the compressible content types
+    :param max_age: Cache-Control max-age of the files
+    """
+    base = Path(root).resolve()
+    policy = set(policy)
+
+    async def handler(request: Request, path: str):
+        source = (base / unquote(path)).resolve()
+        if not source.is_relative_to(base) or not source.is_file():
+            raise NotFound("File not found")
+        mime_type = mimetypes.guess_type(source.name)[0] or "application/octet-stream"
+        target, headers = source, {}
+        if compressible(mime_type, policy):
+            headers["Vary"] = "Accept-Encoding"
+            mtime = source.stat().st_mtime
+            available = [
+                e
+                for e in SUPPORTED_ENCODINGS
+                if fresh(source.with_name(source.name + SUFFIXES[e]), mtime)
+            ]
+            if encoding := negotiate(request.headers.get("accept-encoding"), available):
+                target = source.with_name(source.name + SUFFIXES[encoding])
+                headers["Content-Encoding"] = encoding
+        stat = target.stat()
+        _range = None
+        # ranges are only served for the identity representation
+        if target == source and request.method != "HEAD":
+            headers["Accept-Ranges"] = "bytes"
+            try:
+                _range = ContentRangeHandler(request, stat)
+            except HeaderNotFound:
+                pass
+        if stat.st_size <= STREAM_SIZE:
+            return await file(
+                target,
+                request_headers=request.headers,
+                mime_type=mime_type,
+                headers=headers,
+                last_modified=stat.st_mtime,
+                max_age=max_age,
+                _range=_range,
+            )
+        if not_modified := await validate_file(request.headers, stat.st_mtime):
+            return not_modified
+        headers["Last-Modified"] = formatdate(stat.st_mtime, usegmt=True)
+        headers["Cache-Control"] = f"public, max-age={max_age}"
+        return await file_stream(target, mime_type=mime_type, headers=headers, _range=_range)
+
+    return handler
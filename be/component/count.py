@@ -0,0 +1,104 @@
+"""分页总数缓存
+分页接口的总数很少变化，按 标签 + 规范化的COUNT语句 缓存总数，翻页时只需执行分页查询
+
+每个标签(通常是表名)有一个版本号，版本号是缓存key的一部分，
+invalidate使版本号加一，该标签下的所有总数随之失效，旧的缓存等待过期即可
+
+对没有过滤条件的查询可以使用近似模式，直接读取MySQL的表统计信息(information_schema.TABLES)，
+不会扫描整张表，InnoDB的统计值误差可能达到数十个百分点，只适合展示用途
+"""
+
+import hashlib
+from typing import Awaitable, Callable, Optional
+
+from tortoise import connections
+from tortoise.queryset import QuerySet
+
+from component.cache import Cache
+from component.metrics import metrics
+
+__all__ = ("CountCache",)
+
+count_cache_requests = metrics.counter(
+    "count_cache_requests_total", "Cached total count lookups", ("tag", "result")
+)
+
+
+class CountCache:
+    """分页总数缓存
+
+    :param cache: redis缓存
+    :param expire: 总数的缓存时间，单位为秒
+    :param prefix: key前缀
+    """
+
+    def __init__(self, cache: Cache, expire: int = 300, prefix: str = "count"):
+        self.cache = cache
+        self.expire = expire
+        self.prefix = prefix
+
+    def _version_key(self, tag: str) -> str:
+        return f"{self.prefix}:{tag}:version"
+
+    async def version(self, tag: str) -> int:
+        return await self.cache.get(self._version_key(tag), default=0)
+
+    async def invalidate(self, *tags: str) -> None:
+        """invalidate all the totals of the tags"""
+        for tag in tags:
+            await self.cache.incr(self.cache.build_key(self._version_key(tag)))
+
+    async def get_or_count(
+        self,
+        tag: str,
+        key: str,
+        fn: Callable[[], Awaitable[int]],
+        expire: Optional[int] = None,
+    ) -> int:
+        """
+        :param tag: the invalidation tag
+        :param key: the normalized filter, queries with the same key share the total
+        :param fn: counts the rows when the total is not cached
+        """
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        name = f"{self.prefix}:{tag}:{await self.version(tag)}:{digest}"
+        total = await self.cache.get(name)
+        if total is not None:
+            count_cache_requests.inc(tag, "hit")
+            return total
+        count_cache_requests.inc(tag, "miss")
+        total = await fn()
+        await self.cache.set(name, total, ex=expire or self.expire)
+        return total
+
+    async def count(
+        self, queryset: QuerySet, tag: Optional[str] = None, approximate: bool = False
+    ) -> int:
+        """the cached total of the queryset
+
+        :param tag: the invalidation tag, the table name by default
+        :param approximate: use the table statistics when the queryset has no filter
+        """
+        meta = queryset.model._meta
+        tag = tag or meta.db_table
+        if approximate and not queryset._q_objects:
+            return await self.get_or_count(tag, "approximate", lambda: self.estimate(queryset))
+        return await self.get_or_count(tag, queryset.count().sql(), queryset.count)
+
+    @staticmethod
+    async def estimate(queryset: QuerySet) -> int:
+        """the estimated row number of the table, only MySQL is supported,
+        other databases fall back to COUNT(*)
+        """
+        meta = queryset.model._meta
+        conn = connections.get(meta.default_connection)
+        if conn.capabilities.dialect != "mysql":
+            return await queryset.count()
+        rows = await conn.execute_query_dict(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [meta.db_table],
+        )
+        if not rows or rows[0]["TABLE_ROWS"] is None:
+            return await queryset.count()
+        return int(rows[0]["TABLE_ROWS"])
@@ -6,6 +6,7 @@ from sanic.handlers import ErrorHandler
 from sanic_ext.exceptions import ValidationError
 
 from component.logger import logger
+from component.pagination import InvalidCursor
 from component.response import invalid, method_not_allowed, not_found, server_error
 
 
@@ -19,6 +20,9 @@ class CustomErrorHandler(ErrorHandler):
         if isinstance(exception, (ValidationError,)):
             request.ctx.message = exception.message or exception.args[0]
             return invalid(request)
+        if isinstance(exception, InvalidCursor):
+            request.ctx.message = str(exception)
+            return invalid(request)
         else:
             if request.app.debug:
                 request.ctx.message = traceback.format_exc()
@@ -1,12 +1,23 @@
+import os
+import time
 from asyncio import iscoroutine
 from functools import wraps
 from typing import Optional
 
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import (
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    ModuleLoader,
+)
 from jinja2.runtime import Undefined
 from sanic.models.handler_types import RouteHandler
 from sanic.request import Request
-from sanic.response import html
+from sanic.response import HTTPResponse, html
+
+from component.compress import SUPPORTED_ENCODINGS, compress, encoded_etag, negotiate
+from component.response import make_etag
 
 
 class ExEnvironment(Environment):
@@ -19,6 +30,51 @@ class ExEnvironment(Environment):
         return "" if isinstance(v, Undefined) else v
 
 
+_environment: Optional[ExEnvironment] = None
+
+
+def get_or_init_environment(
+    template_dir: str = "templates",
+    cache_size: int = 400,
+    auto_reload: bool = True,
+    bytecode_cache_dir: Optional[str] = None,
+    precompiled_dir: Optional[str] = None,
+) -> ExEnvironment:
+    """The environment shared by the whole process, compiled templates are kept in its cache.
+
+    :param template_dir: the template search path
+    :param cache_size: the number of compiled templates kept in memory, -1 means unlimited
+    :param auto_reload: check the template source for changes on every lookup,
+        disable it in production
+    :param bytecode_cache_dir: keep the bytecode of the compiled templates on disk so that
+        the workers and the restarts don't compile the same template again
+    :param precompiled_dir: the templates precompiled by `precompile_templates`, they take
+        precedence over the sources
+    """
+    global _environment
+    if _environment is None:
+        loader = FileSystemLoader(template_dir)
+        if precompiled_dir and os.path.isdir(precompiled_dir):
+            loader = ChoiceLoader([ModuleLoader(precompiled_dir), loader])
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        _environment = ExEnvironment(
+            loader=loader,
+            cache_size=cache_size,
+            auto_reload=auto_reload,
+            bytecode_cache=bytecode_cache,
+        )
+    return _environment
+
+
+def precompile_templates(template_dir: str, target: str) -> None:
+    """compile all templates under template_dir into python modules in target"""
+    env = ExEnvironment(loader=FileSystemLoader(template_dir))
+    env.compile_templates(target, zip=None, ignore_errors=True)
+
+
 def render(
     request: Request,
     template_name: str,
@@ -27,23 +83,25 @@ def render(
     status: int = 200,
 ):
     """Returns a rendered file."""
-    if not context:
-        context = {}
-    temp = ExEnvironment(loader=FileSystemLoader("templates"))
-    temp = temp.get_template(template_name)
-    temp.environment.globals.update(url_for=request.app.url_for)
-    _text = temp.render(request=request, **context)
-    return html(_text, status, headers)
+    temp = get_or_init_environment().get_template(template_name)
+    _text = temp.render(request=request, **(context or {}))
+    response = html(_text, status, headers)
+    response.headers.setdefault("ETag", make_etag(response.body))
+    return response
 
 
 def cache_page(second: int):
-    """Cache return page implementation mechanism Add Cache-Control to the HTTP response header
-    Different from the back-end caching function provided by the Cache class, cache_page is a front-end cache that depends on the browser.
+    """Cache return page implementation mechanism
+    Add Cache-Control and ETag to the HTTP response header
+    Different from the back-end caching function provided by the Cache class,
+    cache_page is a front-end cache that depends on the browser.
     How to use
-        1. Single view: Use the decorator @cache_page(60) directly in the view function or class method
+        1. Single view: Use the decorator @cache_page(60) directly in the view function
+           or class method
         2. Global view: There are two ways to use cached pages in the entire view class
             2.1 Add the decorator @cache_page(60) to the class method dispatch_request
-            2.2 Call the cache_page method in the routing table, such as cache_page(60)(Monitor.as_view())
+            2.2 Call the cache_page method in the routing table,
+                such as cache_page(60)(Monitor.as_view())
     :param second: cache expiration time unit: seconds
     :return:
     """
@@ -56,8 +114,77 @@ def cache_page(second: int):
                 response = await response
             headers = {"Cache-Control": "max-age=%i" % second}
             response.headers.update(headers)
+            if response.body and "etag" not in response.headers:
+                response.headers["ETag"] = make_etag(response.body)
             return response
 
         return wrapper
 
     return wrap
+
+
+class StaticPage:
+    """A page kept in memory together with its compressed variants and ETags,
+    it's reloaded when the modification time of the file changes.
+
+    :param path: file path of the page
+    :param content_type: content type of the page
+    :param check_interval: the minimum seconds between two mtime checks,
+        requests in between are served without any disk I/O
+    :param compressed: build and serve the gzip/brotli variants, usually settings.compress.enable
+    """
+
+    def __init__(
+        self,
+        path: str,
+        content_type: str = "text/html; charset=utf-8",
+        check_interval: float = 2.0,
+        compressed: bool = True,
+    ):
+        self.path = path
+        self.content_type = content_type
+        self.check_interval = check_interval
+        self.compressed = compressed
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        # encoding (None means identity) -> (body, etag)
+        self._variants: dict[Optional[str], tuple[bytes, str]] = {}
+
+    def load(self) -> bool:
+        """(re)load the page if the file is modified, return whether it's reloaded"""
+        self._checked = time.monotonic()
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._mtime:
+            return False
+        with open(self.path, "rb") as f:
+            data = f.read()
+        etag = make_etag(data)
+        variants = {None: (data, etag)}
+        for encoding in SUPPORTED_ENCODINGS if self.compressed else ():
+            level = 11 if encoding == "br" else 9
+            variants[encoding] = (compress(data, encoding, level), encoded_etag(etag, encoding))
+        self._variants, self._mtime = variants, mtime
+        return True
+
+    def refresh(self) -> None:
+        if not self._variants or time.monotonic() - self._checked >= self.check_interval:
+            try:
+                self.load()
+            except FileNotFoundError:
+                # keep serving the last loaded version while the file is being replaced
+                if not self._variants:
+                    raise
+
+    def response(self, request: Request, headers: Optional[dict] = None) -> HTTPResponse:
+        """a prebuilt response with the variant negotiated by Accept-Encoding"""
+        self.refresh()
+        if not self.compressed:
+            body, etag = self._variants[None]
+            _headers = {"ETag": etag, **(headers or {})}
+            return HTTPResponse(body, headers=_headers, content_type=self.content_type)
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        body, etag = self._variants[encoding]
+        _headers = {"ETag": etag, "Vary": "Accept-Encoding", **(headers or {})}
+        if encoding:
+            _headers["Content-Encoding"] = encoding
+        return HTTPResponse(body, headers=_headers, content_type=self.content_type)
@@ -0,0 +1,247 @@
+"""指标组件
+按进程记录计数器、仪表与直方图，并以Prometheus文本格式导出
+
+每个worker进程只维护自己的指标，通过push方法周期性地把快照写入redis哈希表，
+collect方法读取所有存活worker的快照并合并，从而得到跨worker的聚合结果
+"""
+
+import os
+import socket
+import time
+from bisect import bisect_left
+from typing import Iterable, Optional, Union
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+from component.cache import Cache
+
+__all__ = ("Counter", "Gauge", "Histogram", "Registry", "metrics")
+
+_SEP = "\x1f"
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.samples: dict[str, Union[float, list]] = {}
+
+    def _key(self, values: tuple) -> str:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {values}")
+        return _SEP.join(str(v) for v in values)
+
+    def dump(self) -> dict:
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labels": self.labels,
+            "samples": self.samples,
+        }
+
+
+class Counter(_Family):
+    """单调递增计数器"""
+
+    kind = "counter"
+
+    def inc(self, *values, amount: float = 1) -> None:
+        key = self._key(values)
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+
+class Gauge(_Family):
+    """可增可减的仪表，跨worker聚合时求和"""
+
+    kind = "gauge"
+
+    def inc(self, *values, amount: float = 1) -> None:
+        key = self._key(values)
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+    def dec(self, *values, amount: float = 1) -> None:
+        self.inc(*values, amount=-amount)
+
+    def set(self, *values, value: float) -> None:
+        self.samples[self._key(values)] = value
+
+
+class Histogram(_Family):
+    """累积直方图
+    每个样本存储为 [bucket_1, ..., bucket_n, +Inf, sum]，bucket计数为非累积值，导出时再累加
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *values, value: float) -> None:
+        key = self._key(values)
+        sample = self.samples.get(key)
+        if sample is None:
+            sample = self.samples[key] = [0] * (len(self.buckets) + 2)
+        sample[bisect_left(self.buckets, value)] += 1
+        sample[-1] += value
+
+    def dump(self) -> dict:
+        data = super().dump()
+        data["buckets"] = self.buckets
+        return data
+
+
+class Registry:
+    """指标注册表
+
+    :param namespace: 指标名前缀
+    """
+
+    def __init__(self, namespace: str = ""):
+        self.namespace = namespace
+        self._families: dict[str, _Family] = {}
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _register(self, family: _Family) -> _Family:
+        if self.namespace:
+            family.name = f"{self.namespace}_{family.name}"
+        if family.name in self._families:
+            registered = self._families[family.name]
+            if type(registered) is not type(family) or registered.labels != family.labels:
+                raise ValueError(f"Metric {family.name} already registered")
+            return registered
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def snapshot(self) -> dict:
+        """当前进程的指标快照"""
+        return {name: family.dump() for name, family in self._families.items()}
+
+    @staticmethod
+    def merge(snapshots: Iterable[dict]) -> dict:
+        """合并多个worker的快照，同名同标签的样本逐项相加"""
+        merged: dict[str, dict] = {}
+        for snapshot in snapshots:
+            for name, family in snapshot.items():
+                target = merged.get(name)
+                if target is None:
+                    target = merged[name] = {**family, "samples": {}}
+                samples = target["samples"]
+                for key, value in family["samples"].items():
+                    if key not in samples:
+                        samples[key] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        samples[key] = [a + b for a, b in zip(samples[key], value)]
+                    else:
+                        samples[key] += value
+        return merged
+
+    @staticmethod
+    def render(snapshot: dict) -> str:
+        """以Prometheus文本格式(0.0.4)导出快照"""
+        lines = []
+        for name in sorted(snapshot):
+            family = snapshot[name]
+            labels = family["labels"]
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            for key in sorted(family["samples"]):
+                value = family["samples"][key]
+                pairs = _label_pairs(labels, key.split(_SEP) if labels else ())
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                bounds = [*family["buckets"], "+Inf"]
+                for bound, count in zip(bounds, value[:-1]):
+                    cumulative += count
+                    le = bound if isinstance(bound, str) else _format_value(bound)
+                    lines.append(
+                        f"{name}_bucket{_format_labels([*pairs, ('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {cumulative}")
+        lines.append("")
+        return "\n".join(lines)
+
+    async def push(self, cache: Cache, key: str = "metrics:workers", ttl: float = 60) -> None:
+        """把当前进程的快照写入redis，ttl秒内未更新的worker在collect时被忽略"""
+        payload = _json.dumps({"ts": time.time(), "ttl": ttl, "metrics": self.snapshot()})
+        await cache.hset(cache.build_key(key), self.worker, payload)
+
+    async def collect(self, cache: Optional[Cache] = None, key: str = "metrics:workers") -> dict:
+        """聚合所有存活worker的快照；cache为None或redis不可用时只返回当前进程的快照"""
+        if cache is None:
+            return self.snapshot()
+        try:
+            workers = await cache.hgetall(cache.build_key(key))
+        except Exception:
+            return self.snapshot()
+        now, expired, snapshots = time.time(), [], []
+        for worker, payload in workers.items():
+            worker = worker.decode() if isinstance(worker, bytes) else worker
+            if worker == self.worker:
+                continue
+            data = _json.loads(payload)
+            if now - data["ts"] > data["ttl"]:
+                expired.append(worker)
+                continue
+            snapshots.append(data["metrics"])
+        if expired:
+            await cache.hdel(cache.build_key(key), *expired)
+        snapshots.append(self.snapshot())
+        return self.merge(snapshots)
+
+
+def _label_pairs(labels: Iterable[str], values: Iterable[str]) -> list[tuple[str, str]]:
+    return list(zip(labels, values))
+
+
+def _format_labels(pairs: list[tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# let user to use default registry
+metrics = Registry()
@@ -0,0 +1,84 @@
+"""游标分页组件
+游标是不透明的字符串，编码了上一页最后一行的排序字段值，下一页的查询条件由这些值构造，
+查询代价与页码深度无关，不需要像OFFSET一样扫描并丢弃前面的行
+
+排序字段必须以唯一字段(通常是主键)结尾，否则排序值相同的行可能被跳过
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Sequence
+
+from tortoise.expressions import Q
+
+__all__ = ("InvalidCursor", "encode_cursor", "decode_cursor", "keyset", "next_cursor")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _default(obj: Any):
+    if isinstance(obj, datetime):
+        return {"$dt": obj.isoformat()}
+    raise TypeError(f"{type(obj).__name__} is not allowed in a cursor")
+
+
+def _object_hook(obj: dict):
+    if "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def encode_cursor(values: Sequence) -> str:
+    data = json.dumps(list(values), default=_default, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, size: Optional[int] = None) -> list:
+    """
+    :param cursor: the cursor returned by encode_cursor
+    :param size: the expected number of the values
+    :raise InvalidCursor: the cursor is malformed
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data, object_hook=_object_hook)
+    except (ValueError, TypeError):
+        raise InvalidCursor("invalid cursor")
+    if not isinstance(values, list) or (size is not None and len(values) != size):
+        raise InvalidCursor("invalid cursor")
+    return values
+
+
+def keyset(ordering: Sequence[str], values: Sequence) -> Q:
+    """the condition of the rows after the values in the ordering
+    e.g. ordering ("-rank", "id") and values (3, 10) give
+        rank < 3 OR (rank = 3 AND id > 10)
+
+    :param ordering: the order_by fields, a "-" prefix means descending
+    :param values: the values of the fields of the last row
+    """
+    if len(ordering) != len(values):
+        raise InvalidCursor("invalid cursor")
+    q = None
+    for i, (field, value) in enumerate(zip(ordering, values)):
+        name = field.lstrip("-")
+        op = "lt" if field.startswith("-") else "gt"
+        cond = Q(**{f"{name}__{op}": value})
+        for prev_field, prev_value in zip(ordering[:i], values[:i]):
+            cond &= Q(**{prev_field.lstrip("-"): prev_value})
+        q = cond if q is None else q | cond
+    return q
+
+
+def next_cursor(rows: Sequence, ordering: Sequence[str], size: int) -> Optional[str]:
+    """the cursor of the next page, None means it's the last page
+    :param rows: model instances or dicts of the current page
+    """
+    if len(rows) < size:
+        return None
+    last = rows[-1]
+    get = last.get if isinstance(last, dict) else lambda k: getattr(last, k)
+    return encode_cursor([get(field.lstrip("-")) for field in ordering])
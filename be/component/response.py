@@ -1,12 +1,32 @@
+import hashlib
+import re
 import uuid
 from types import SimpleNamespace
-from typing import Any, Generic, TypeVar
+from typing import Any, Generic, Optional, Sequence, TypeVar
 
+import orjson
 from pydantic import BaseModel, Field
-from sanic import Request, json
+from sanic import HTTPResponse, Request, json
+
+from component.compress import StreamCompressor, compressible, negotiate
+from component.metrics import metrics
+from config import settings
 
 T = TypeVar("T")
 
+# the suffix appended to the ETag of the compressed representations
+_ENCODING_SUFFIX = re.compile(r'-(?:gzip|br)"$')
+# the head of the response envelope encoded by orjson
+_ENVELOPE_HEAD = re.compile(rb'^\{"response_id":"[0-9a-f-]{36}",')
+
+# the same family as the one of the metrics middleware, which can't see the size of a stream
+_stream_size = metrics.histogram(
+    "http_response_size_bytes",
+    "HTTP response body size in bytes.",
+    ("route", "method", "status"),
+    buckets=settings.metrics.size_buckets,
+)
+
 
 class NormalResponse(BaseModel, Generic[T]):
     response_id: uuid.UUID = Field()
@@ -21,6 +41,42 @@ def _get_or_set_context_attribute(ctx: SimpleNamespace, key: str, value: Any = N
     return getattr(ctx, key)
 
 
+def make_etag(data: bytes) -> str:
+    """strong ETag derived from the content hash"""
+    return '"%s"' % hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """whether the If-None-Match header matches the ETag, using the weak comparison"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = _normalize_etag(etag)
+    return any(_normalize_etag(tag) == etag for tag in if_none_match.split(","))
+
+
+def _normalize_etag(etag: str) -> str:
+    return _ENCODING_SUFFIX.sub('"', etag.strip().removeprefix("W/"))
+
+
+def _envelope_etag(response_id: Any, body: bytes) -> str:
+    # response_id is unique per response, so it must be excluded from the content hash
+    head = b'{"response_id":"%s",' % str(response_id).encode()
+    return make_etag(body[len(head) :] if body.startswith(head) else body)
+
+
+def renew_response_id(request: Request, response: HTTPResponse) -> HTTPResponse:
+    """replace the response_id of a cached envelope with the one of the current request,
+    the ETag is left as it is since it doesn't cover the response_id
+    """
+    if response.body and _ENVELOPE_HEAD.match(response.body):
+        response_id = _get_or_set_context_attribute(request.ctx, "response_id", uuid.uuid4())
+        head = b'{"response_id":"%s",' % str(response_id).encode()
+        response.body = _ENVELOPE_HEAD.sub(head, response.body, count=1)
+    return response
+
+
 def ok(request: Request, data: Any):
     ctx: SimpleNamespace = request.ctx
     ctx.response_data = {
@@ -29,7 +85,67 @@ def ok(request: Request, data: Any):
         "message": _get_or_set_context_attribute(ctx, "message", "ok"),
         "data": data,
     }
-    return json(ctx.response_data)
+    resp = json(ctx.response_data)
+    resp.headers["ETag"] = _envelope_etag(ctx.response_id, resp.body)
+    return resp
+
+
+async def ok_stream(
+    request: Request, data: dict, items: Sequence[BaseModel], chunk: int = 100
+) -> Optional[HTTPResponse]:
+    """the same envelope as ok with the items in data["items"],
+    more than chunk items are serialized and sent chunk by chunk instead of rendering one body
+
+    a streamed response is compressed chunk by chunk, but it has no ETag and is never answered
+    with 304 Not Modified, since its content is unknown until the last chunk
+    :return: None when the response has been streamed
+    """
+    if len(items) <= chunk:
+        return ok(request, {**data, "items": [item.model_dump() for item in items]})
+    ctx: SimpleNamespace = request.ctx
+    ctx.response_data = {
+        "response_id": _get_or_set_context_attribute(ctx, "response_id", uuid.uuid4()),
+        "code": _get_or_set_context_attribute(ctx, "code", 200),
+        "message": _get_or_set_context_attribute(ctx, "message", "ok"),
+        "data": data,
+    }
+    envelope = orjson.dumps({**ctx.response_data, "data": {**data, "items": []}})
+    # split the envelope at the empty list, the items are written in between
+    prefix, suffix = envelope.rsplit(b"[]", 1)
+
+    conf, compressor, headers = settings.compress, None, {}
+    if conf.enable and compressible("application/json", conf.content_types):
+        headers["Vary"] = "Accept-Encoding"
+        if encoding := negotiate(request.headers.get("accept-encoding")):
+            level = conf.brotli_quality if encoding == "br" else conf.gzip_level
+            compressor = StreamCompressor(encoding, level)
+            headers["Content-Encoding"] = encoding
+    # the response middleware runs in respond, before the body is known
+    ctx.streamed = True
+    resp = await request.respond(headers=headers, content_type="application/json")
+    size = 0
+
+    async def send(body: bytes):
+        nonlocal size
+        if compressor:
+            body = compressor.compress(body)
+        size += len(body)
+        await resp.send(body)
+
+    await send(prefix + b"[")
+    for i in range(0, len(items), chunk):
+        part = b",".join(item.model_dump_json().encode() for item in items[i : i + chunk])
+        await send(part if i == 0 else b"," + part)
+    await send(b"]" + suffix)
+    if compressor:
+        tail = compressor.finish()
+        size += len(tail)
+        await resp.send(tail)
+    await resp.eof()
+    if settings.metrics.enable and request.route:
+        route = request.route.name.split(".", 1)[-1]
+        _stream_size.observe(route, request.method, resp.status, value=size)
+    return None
 
 
 def forbidden(request: Request, data: Any = None):
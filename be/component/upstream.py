@@ -0,0 +1,195 @@
+"""上游HTTP客户端组件
+每个上游服务(如maplestory.io、reCAPTCHA)使用独立命名的httpx客户端，由配置文件的[upstreams.<名称>]
+指定连接池大小、单次调用的截止时间与是否启用HTTP/2，一个慢的上游不会占满其他上游的连接
+
+每个上游有一个熔断器：连续失败failure_threshold次后熔断，熔断期间的调用直接抛出UpstreamUnavailable，
+调用方可以返回缓存或占位响应；经过recovery_time秒后放行一次试探调用，成功则恢复，失败则继续熔断
+
+HTTP/2需要安装h2，未安装时退回HTTP/1.1
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+
+from component.logger import logger
+from component.metrics import metrics
+from config import UpstreamConfig, settings
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+__all__ = (
+    "UpstreamError",
+    "UpstreamUnavailable",
+    "CircuitBreaker",
+    "Upstream",
+    "get_or_init_upstream",
+    "close_upstreams",
+)
+
+upstream_requests = metrics.counter(
+    "upstream_requests_total", "Requests to the upstream services", ("upstream", "result")
+)
+upstream_seconds = metrics.histogram(
+    "upstream_request_seconds",
+    "Latency of the requests to the upstream services",
+    ("upstream",),
+    buckets=settings.metrics.latency_buckets,
+)
+upstream_open = metrics.gauge(
+    "upstream_circuit_open", "Workers whose circuit of the upstream is open", ("upstream",)
+)
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class UpstreamUnavailable(UpstreamError):
+    """the circuit of the upstream is open"""
+
+
+class CircuitBreaker:
+    """熔断器
+
+    :param failure_threshold: 连续失败多少次后熔断
+    :param recovery_time: 熔断多少秒后放行一次试探调用
+    """
+
+    def __init__(self, failure_threshold: int = 5, recovery_time: float = 30):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        """whether a call is allowed, only one probe is allowed after the recovery time"""
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < self.recovery_time:
+            return False
+        self.probing = True
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def failure(self) -> None:
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self) -> None:
+        """the call ended without a result, e.g. it was cancelled, another probe is allowed"""
+        self.probing = False
+
+
+class Upstream:
+    """命名的上游客户端
+
+    :param name: 上游名称，用于指标标签
+    :param conf: 上游配置
+    """
+
+    def __init__(self, name: str, conf: UpstreamConfig):
+        self.name = name
+        self.conf = conf
+        if conf.http2 and h2 is None:
+            logger.warning(f"h2 is not installed, upstream {name} falls back to HTTP/1.1")
+        self.client = httpx.AsyncClient(
+            base_url=conf.base_url or "",
+            http2=conf.http2 and h2 is not None,
+            limits=httpx.Limits(
+                max_connections=conf.max_connections,
+                max_keepalive_connections=conf.max_keepalive_connections,
+                keepalive_expiry=conf.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(conf.timeout, connect=conf.connect_timeout),
+        )
+        self.breaker = CircuitBreaker(conf.failure_threshold, conf.recovery_time)
+
+    def _record(self, result: str, failed: bool) -> None:
+        upstream_requests.inc(self.name, result)
+        was_open = self.breaker.is_open
+        if failed:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        if was_open != self.breaker.is_open:
+            upstream_open.set(self.name, value=int(self.breaker.is_open))
+            if self.breaker.is_open:
+                logger.warning(f"upstream {self.name} is unhealthy, the circuit is open")
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """send the request within the deadline of the upstream
+        :raise UpstreamUnavailable: the circuit is open
+        :raise UpstreamError: the request failed, timed out or got a 5xx response
+        """
+        if not self.breaker.allow():
+            upstream_requests.inc(self.name, "rejected")
+            raise UpstreamUnavailable(f"upstream {self.name} is unavailable")
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self.client.request(method, url, **kwargs), self.conf.deadline
+            )
+        except (asyncio.TimeoutError, httpx.TimeoutException) as err:
+            self._record("timeout", True)
+            raise UpstreamError(f"upstream {self.name} timed out") from err
+        except httpx.HTTPError as err:
+            self._record("error", True)
+            raise UpstreamError(f"upstream {self.name} failed: {err!r}") from err
+        except BaseException:
+            # cancelled by a client disconnect or an invalid request, neither is a verdict
+            self.breaker.release()
+            raise
+        finally:
+            upstream_seconds.observe(self.name, value=time.perf_counter() - start)
+        if response.status_code >= 500:
+            self._record("error", True)
+            raise UpstreamError(f"upstream {self.name} responded {response.status_code}")
+        self._record("ok", False)
+        return response
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_upstreams: dict[str, Upstream] = {}
+
+
+def get_or_init_upstream(name: str, base_url: Optional[str] = None) -> Upstream:
+    """the upstream client of the worker, the default config is used when it's not configured
+    :param base_url: used when the config has no base_url
+    """
+    if name not in _upstreams:
+        conf = settings.upstreams.get(name) or UpstreamConfig()
+        if not conf.base_url and base_url:
+            conf = conf.model_copy(update={"base_url": base_url})
+        _upstreams[name] = Upstream(name, conf)
+    return _upstreams[name]
+
+
+async def close_upstreams() -> None:
+    while _upstreams:
+        _, upstream = _upstreams.popitem()
+        await upstream.aclose()
@@ -1,11 +1,16 @@
+import hashlib
 import importlib
 from inspect import iscoroutine, iscoroutinefunction
-from typing import Callable, List, Tuple, Union
+from typing import Callable, List, Optional, Tuple, Union
+from urllib.parse import urlencode
 
+import orjson
 from sanic import HTTPResponse
 from sanic.views import HTTPMethodView
 
 from component import response
+from component.cache import cache
+from component.metrics import metrics
 from component.throttle import ThrottleInterface
 from config import settings
 
@@ -133,7 +138,103 @@ class PermissionView(HTTPMethodView):
             return result
 
 
-class JWTView(AuthenticateView, PermissionView, ThrottleView):
+view_cache_requests = metrics.counter(
+    "view_cache_requests_total", "Response cache lookups of view classes.", ("view", "result")
+)
+
+
+class ResponseSerializer:
+    """Serializer of a cached response: a JSON header line followed by the raw body"""
+
+    @staticmethod
+    def dumps(obj: HTTPResponse, *args, **kwargs) -> bytes:
+        # the keys of the sanic headers are istr, which orjson refuses
+        headers = {
+            str(k): v
+            for k, v in obj.headers.items()
+            if k.lower() not in {"content-length", "content-type", "set-cookie"}
+        }
+        meta = {"status": obj.status, "content_type": obj.content_type, "headers": headers}
+        return orjson.dumps(meta) + b"\n" + obj.body
+
+    @staticmethod
+    def loads(s: bytes, *args, **kwargs) -> HTTPResponse:
+        meta, body = s.split(b"\n", 1)
+        meta = orjson.loads(meta)
+        return HTTPResponse(body, meta["status"], meta["headers"], meta["content_type"])
+
+
+class ResponseCacheView(HTTPMethodView):
+    """Cache the final encoded response of a view class, repeat hits skip the handler entirely.
+    The cache key is made of the method, path, normalized query and the auth class of the user,
+    so only responses which are identical for all anonymous (or all logged-in) users are allowed.
+
+    cache_timeout: seconds to keep a response, 0 disables the response cache
+    cache_methods: the methods could be served from the cache
+    cache_name: the cache database to store responses
+    cache_ignore_args: query arguments which don't affect the response
+    """
+
+    cache_timeout: int = 0
+    cache_methods: Tuple[str, ...] = ("GET",)
+    cache_name: str = "redis"
+    cache_ignore_args: Tuple[str, ...] = ("token",)
+
+    def cache_key(self, request) -> str:
+        auth = "anonymous" if getattr(request.ctx, "user", None) is None else "user"
+        args = sorted((k, v) for k, v in request.query_args if k not in self.cache_ignore_args)
+        raw = f"{request.method}:{request.path}?{urlencode(args)}:{auth}"
+        return f"view:{self.__class__.__name__}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+    def _cacheable(self, request) -> bool:
+        return self.cache_timeout > 0 and request.method in self.cache_methods
+
+    async def _cache_lookup(self, request) -> Optional[HTTPResponse]:
+        if not self._cacheable(request):
+            return None
+        key = self.cache_key(request)
+        try:
+            cached = await cache.select(self.cache_name).get(key, serializer=ResponseSerializer)
+        except Exception:
+            cached = None
+        view_cache_requests.inc(self.__class__.__name__, "hit" if cached else "miss")
+        if cached is None:
+            return None
+        # every response has its own response_id, even if it comes from the cache
+        return response.renew_response_id(request, cached)
+
+    async def _cache_store(self, request, result: Optional[HTTPResponse]):
+        # None means the response has been streamed by the handler
+        if result is None or not self._cacheable(request):
+            return
+        # the code of the response envelope is set by component.response
+        if result.status != 200 or getattr(request.ctx, "code", 200) != 200:
+            return
+        if result.body is None or "set-cookie" in result.headers:
+            return
+        key = self.cache_key(request)
+        try:
+            await cache.select(self.cache_name).set(
+                key, result, ResponseSerializer, ex=self.cache_timeout
+            )
+        except Exception:
+            # the response is still served when the cache is unavailable
+            pass
+
+    async def dispatch_request(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if handler is None:
+            return HTTPResponse(status=405)
+        if cached := await self._cache_lookup(request):
+            return cached
+        result = handler(request, *args, **kwargs)
+        if iscoroutine(result):
+            result = await result
+        await self._cache_store(request, result)
+        return result
+
+
+class JWTView(AuthenticateView, PermissionView, ThrottleView, ResponseCacheView):
     """View class that implements jwt authentication"""
 
     authentications = JWT_AUTH.authentications
@@ -152,8 +253,10 @@ class JWTView(AuthenticateView, PermissionView, ThrottleView):
         if pem := await self._permission(request):
             request.ctx.message = pem
             return await self.proc_permission(request)
+        if cached := await self._cache_lookup(request):
+            return cached
         result = handler(request, *args, **kwargs)
         if iscoroutine(result):
-            return await result
-        else:
-            return result
+            result = await result
+        await self._cache_store(request, result)
+        return result
@@ -140,6 +140,93 @@ class RegisterConfig(BaseModel):
     recaptcha_url: str = "https://recaptcha.net/recaptcha/api/siteverify"
 
 
+class MetricsConfig(BaseModel):
+    enable: bool = True
+    authorized: list[str] = []
+    flush_interval: float = 15
+    latency_buckets: list[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+    size_buckets: list[int] = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+
+
+class CompressConfig(BaseModel):
+    enable: bool = True
+    min_size: int = 1024
+    # bodies larger than this are compressed in the thread pool
+    offload_size: int = 262144
+    gzip_level: int = 6
+    brotli_quality: int = 5
+    content_types: list[str] = [
+        "text/html",
+        "text/css",
+        "text/plain",
+        "text/javascript",
+        "application/javascript",
+        "application/json",
+        "application/xml",
+        "image/svg+xml",
+    ]
+    precompress_static: bool = True
+    static_max_age: int = 3600
+
+
+class LeaderboardConfig(BaseModel):
+    enable: bool = True
+    # seconds between two syncs of the rankings, only one worker syncs in each interval,
+    # a sync only reads the characters logged out since the last sync and the online ones
+    sync_interval: int = 900
+    # seconds between two full syncs, which run the GROUP BY scans of all the quests and
+    # monster book cards and remove the deleted characters
+    full_sync_interval: int = 86400
+    # the guild leaderboard is rebuilt when the GP changes or it's older than this
+    guild_max_age: int = 3600
+
+
+class JinjaConfig(BaseModel):
+    template_dir: str = "templates"
+    cache_size: int = 400
+    auto_reload: bool = True
+    bytecode_cache_dir: Optional[str] = None
+    # templates are compiled into this directory on startup when it's set
+    precompiled_dir: Optional[str] = None
+
+
+class RenderConfig(BaseModel):
+    # the size of the transcoding pool, a process pool is used when the worker can fork
+    workers: int = 2
+    # transcodes waiting for a free pool worker, more are rejected
+    max_pending: int = 32
+    timeout: float = 10
+    # "maplestory.io" or "local", the local renderer composites the sprites under sprite_root
+    renderer: str = "maplestory.io"
+    sprite_root: str = "asset/sprites/stub"
+    # concurrent maplestory.io requests of each worker
+    upstream_concurrency: int = 4
+    # the avatars of a rank page are placed on a grid of this many columns
+    atlas_columns: int = 5
+    # WEBP encoder parameters
+    quality: int = Field(default=80, ge=0, le=100)
+    method: int = Field(default=4, ge=0, le=6)
+    lossless: bool = False
+
+
+class UpstreamConfig(BaseModel):
+    base_url: Optional[str] = None
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30
+    # the read/write/pool timeout and the connect timeout of httpx
+    timeout: float = 5
+    connect_timeout: float = 3
+    # the deadline of one call including the retries of the connection pool
+    deadline: float = 10
+    # requires the h2 package
+    http2: bool = False
+    # the circuit opens after this many consecutive failures
+    failure_threshold: int = 5
+    # seconds before a probe is allowed through an open circuit
+    recovery_time: float = 30
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_nested_delimiter="__")
 
@@ -164,6 +251,12 @@ class Settings(BaseSettings):
     game_server: Optional[GameServerConfig] = None
     rpc_server: Optional[RPCConfig] = None
     gtop100: Optional[GTop100Config] = None
+    metrics: MetricsConfig = MetricsConfig()
+    compress: CompressConfig = CompressConfig()
+    jinja: JinjaConfig = JinjaConfig()
+    leaderboard: LeaderboardConfig = LeaderboardConfig()
+    render: RenderConfig = RenderConfig()
+    upstreams: dict[str, UpstreamConfig] = {}
 
     def __init__(self, **values: Any):
         super().__init__(**values)
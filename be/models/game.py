@@ -4,9 +4,10 @@
 from typing import List, Optional
 
 import bcrypt
+from pypika import Table
 from tortoise import Model, fields
 from tortoise.expressions import F
-from tortoise.functions import Count, Sum
+from tortoise.functions import Count, Max, Sum
 
 
 class User(Model):
@@ -104,6 +105,27 @@ class User(Model):
         return 1
 
 
+# -1 帽子  -2 脸饰 -3 眼饰 -4 耳环 -5 上衣 -6 裤子 -7 鞋子
+# -8 手套 -9 披风 -10 盾牌 -11 武器，位置减100为同一槽位的现金装备，现金装备优先显示
+EQUIP_SLOTS: dict[int, tuple[str, bool]] = {
+    position - offset: (slot, bool(offset))
+    for slot, position in (
+        ("Cap", -1),
+        ("AccessoryFace", -2),
+        ("AccessoryEye", -3),
+        ("AccessoryEar", -4),
+        ("Coat", -5),
+        ("Pants", -6),
+        ("Shoes", -7),
+        ("Glove", -8),
+        ("Cape", -9),
+        ("Shield", -10),
+        ("Weapon", -11),
+    )
+    for offset in (0, 100)
+}
+
+
 class Character(Model):
 
     class Meta:
@@ -197,45 +219,25 @@ class Character(Model):
         """获取角色外观装备信息
         :return: 装备信息
         """
-        # -1 帽子  -2 脸饰 -3 眼饰 -4 耳环 -5 上衣 -6 裤子 -7 鞋子
-        # -8 手套 -9 披风 -109 现金披风 -10 盾牌 -11 武器 -12 戒指 -17 吊坠
-        equip_info = {}
-        equips = await InvItem.filter(characterid=self.id, inventorytype=-1)
+        return (await self.equip_infos([self.id]))[self.id]
+
+    @staticmethod
+    async def equip_infos(character_ids: List[int]) -> dict[int, dict[str, "InvItem"]]:
+        """批量获取角色外观装备信息，所有角色只查询一次
+        :return: 角色id -> 装备信息
+        """
+        result: dict[int, dict[str, InvItem]] = {i: {} for i in character_ids}
+        if not result:
+            return result
+        equips = await InvItem.filter(
+            characterid__in=list(result), inventorytype=-1, position__in=list(EQUIP_SLOTS)
+        )
         for equip in equips:
-            if equip.position in (-1, -101):
-                if "Cap" not in equip_info or equip.position == -101:
-                    equip_info["Cap"] = equip
-            elif equip.position in (-2, -102):
-                if "AccessoryFace" not in equip_info or equip.position == -102:
-                    equip_info["AccessoryFace"] = equip
-            elif equip.position in (-3, -103):
-                if "AccessoryEye" not in equip_info or equip.position == -103:
-                    equip_info["AccessoryEye"] = equip
-            elif equip.position in (-4, -104):
-                if "AccessoryEar" not in equip_info or equip.position == -104:
-                    equip_info["AccessoryEar"] = equip
-            elif equip.position in (-5, -105):
-                if "Coat" not in equip_info or equip.position == -105:
-                    equip_info["Coat"] = equip
-            elif equip.position in (-6, -106):
-                if "Pants" not in equip_info or equip.position == -106:
-                    equip_info["Pants"] = equip
-            elif equip.position in (-7, -107):
-                if "Shoes" not in equip_info or equip.position == -107:
-                    equip_info["Shoes"] = equip
-            elif equip.position in (-8, -108):
-                if "Glove" not in equip_info or equip.position == -108:
-                    equip_info["Glove"] = equip
-            elif equip.position in (-9, -109):
-                if "Cape" not in equip_info or equip.position == -109:
-                    equip_info["Cape"] = equip
-            elif equip.position in (-10, -110):
-                if "Shield" not in equip_info or equip.position == -110:
-                    equip_info["Shield"] = equip
-            elif equip.position in (-11, -111):
-                if "Weapon" not in equip_info or equip.position == -111:
-                    equip_info["Weapon"] = equip
-        return equip_info
+            slot, cash = EQUIP_SLOTS[equip.position]
+            info = result[equip.characterid]
+            if cash or slot not in info:
+                info[slot] = equip
+        return result
 
 
 class Guild(Model):
@@ -298,8 +300,14 @@ class Guild(Model):
     def alliance_name(self, value: str):
         self._alliance_name = value
 
+    @property
+    def score(self) -> int:
+        """the weighted ranking key, higher is better"""
+        return self.GP * 1000 + self.member * 100 + self.capacity * 10 - self.guildid
+
     @staticmethod
-    async def get_top_n(n=100) -> List["Guild"]:
+    async def get_top_n(n: int = 100) -> List["Guild"]:
+        """the top n guilds by GP sorted by the score"""
         guilds = await Guild.filter().limit(n).order_by("-GP")
         members = (
             await Character.filter(guildid__in=[guild.guildid for guild in guilds])
@@ -309,18 +317,8 @@ class Guild(Model):
         )
         members_dict = {member["guildid"]: member["count"] for member in members}
         for guild in guilds:
-            guild.member_count = members_dict.get(guild.guildid, 0)
-        sort_guilds = list(
-            sorted(
-                guilds,
-                reverse=True,
-                key=lambda g: g.GP * 1000
-                + members_dict[g.guildid] * 100
-                + g.capacity * 10
-                - g.guildid,
-            )
-        )
-        return sort_guilds
+            guild.member = members_dict.get(guild.guildid, 0)
+        return sorted(guilds, reverse=True, key=lambda g: g.score)
 
 
 class InvItem(Model):
@@ -342,6 +340,60 @@ class InvItem(Model):
     expiration = fields.BigIntField(default=-1)
     giftFrom = fields.CharField(max_length=26)
 
+    @classmethod
+    async def fingerprint(cls, character_id: int, inventorytype: int) -> str:
+        """背包的指纹，物品增删、移动或重新保存后指纹随之变化，用于缓存失效
+        游戏服务端保存角色时会删除并重新写入物品，自增主键的最大值也会变化
+        """
+        row = (
+            await cls.filter(characterid=character_id, inventorytype=inventorytype)
+            .annotate(
+                count=Count("inventoryitemid"),
+                last=Max("inventoryitemid"),
+                items=Sum("itemid"),
+                positions=Sum("position"),
+            )
+            .first()
+            .values("count", "last", "items", "positions")
+        )
+        return "-".join(str(row[k] or 0) for k in ("count", "last", "items", "positions"))
+
+    @classmethod
+    async def with_stats(
+        cls,
+        character_id: int,
+        inventorytype: Optional[int] = None,
+        offset: int = 0,
+        limit: Optional[int] = None,
+    ) -> list[dict]:
+        """背包物品及其装备属性，使用一次LEFT JOIN查询，按物品种类、背包位置排序
+        :param inventorytype: None表示所有种类
+        :return: 物品的列，装备属性在"stats"中，没有装备属性时为None
+        """
+        db = cls._meta.db
+        item, equip = Table(cls._meta.db_table), Table(InvEquip._meta.db_table)
+        query = (
+            db.query_class.from_(item)
+            .left_join(equip)
+            .on(equip.inventoryitemid == item.inventoryitemid)
+            .select(
+                *(item[c] for c in cls._meta.db_fields),
+                *(equip[c].as_(f"stats__{c}") for c in InvEquip._meta.db_fields),
+            )
+            .where(item.characterid == character_id)
+            .orderby(item.inventorytype, item.position)
+        )
+        if inventorytype is not None:
+            query = query.where(item.inventorytype == inventorytype)
+        if limit is not None:
+            query = query.limit(limit).offset(offset)
+        rows = []
+        for row in await db.execute_query_dict(str(query)):
+            stats = {k[7:]: row.pop(k) for k in list(row) if k.startswith("stats__")}
+            row["stats"] = stats if stats["inventoryequipmentid"] is not None else None
+            rows.append(row)
+        return rows
+
 
 class InvEquip(Model):
     class Meta:
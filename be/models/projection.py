@@ -0,0 +1,53 @@
+"""列投影
+列表接口只查询响应模型需要的列，并用缓存的TypeAdapter一次性校验整个列表，
+避免为每一行实例化完整的Tortoise模型再逐个model_validate
+
+响应模型字段的alias(没有alias时为字段名)即数据库模型的字段名，不在数据库模型中的字段
+(如计算属性)不会被查询，这类字段需要有默认值或由调用方补全
+"""
+
+from functools import lru_cache
+from typing import Type, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+from tortoise import Model
+from tortoise.queryset import QuerySet
+
+__all__ = ("columns", "list_adapter", "project", "validate_list", "fetch")
+
+S = TypeVar("S", bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def columns(schema: Type[BaseModel], model: Type[Model]) -> tuple[str, ...]:
+    """the fields of the model required by the schema"""
+    fields_map = model._meta.fields_map
+    result = []
+    for name, info in schema.model_fields.items():
+        column = info.alias or name
+        if column in fields_map:
+            result.append(column)
+    return tuple(result)
+
+
+@lru_cache(maxsize=None)
+def list_adapter(schema: Type[S]) -> TypeAdapter[list[S]]:
+    return TypeAdapter(list[schema])
+
+
+async def project(queryset: QuerySet, schema: Type[BaseModel], *extra: str) -> list[dict]:
+    """fetch the columns of the schema as dicts
+    :param extra: additional fields, e.g. the sort keys of a cursor
+    """
+    fields = columns(schema, queryset.model)
+    fields += tuple(f for f in extra if f not in fields)
+    return await queryset.values(*fields)
+
+
+def validate_list(schema: Type[S], rows: list[dict]) -> list[S]:
+    return list_adapter(schema).validate_python(rows)
+
+
+async def fetch(queryset: QuerySet, schema: Type[S]) -> list[S]:
+    """the rows of the queryset validated as the schema"""
+    return validate_list(schema, await project(queryset, schema))
@@ -1,7 +1,16 @@
 from datetime import datetime
 from typing import Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, Field, field_serializer, model_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    Field,
+    field_serializer,
+    field_validator,
+    model_validator,
+)
+
+from component.pagination import decode_cursor
 
 
 class UserName(BaseModel):
@@ -67,9 +76,34 @@ class GameOnlineResponse(BaseModel):
     characters: Optional[list[str]] = None
 
 
-class CharRankRequest(BaseModel):
+class CursorArgs(BaseModel):
+    # the next_cursor of the previous page, the page argument is ignored when it's set
+    cursor: Optional[str] = None
+
+    @field_validator("cursor")
+    @classmethod
+    def check_cursor(cls, value: Optional[str]) -> Optional[str]:
+        if value:
+            decode_cursor(value)
+        return value or None
+
+
+# job filter of the rankings -> inclusive range of the job codes
+JOB_GROUPS: dict[str, tuple[int, int]] = {
+    "beginner": (0, 0),
+    "warrior": (100, 132),
+    "magician": (200, 232),
+    "bowman": (300, 322),
+    "thief": (400, 422),
+    "pirate": (500, 522),
+    "cygnus": (1000, 1999),
+    "aran": (2100, 2112),
+}
+
+
+class CharRankRequest(CursorArgs):
     page: int = Field(default=1, ge=1)
-    size: int = 10
+    size: int = Field(default=10, ge=1, le=100)
     job: Literal[
         "all",
         "beginner",
@@ -82,26 +116,20 @@ class CharRankRequest(BaseModel):
         "aran",
     ] = "all"
     sort: Literal["level", "fame", "quest", "monsterbook"] = "level"
+    # None means all worlds
+    world: Optional[int] = Field(default=None, ge=0)
 
     @property
     def cond(self):
         c = {"gm__lt": 2}
-        if self.job == "beginner":
-            c["job"] = 0
-        elif self.job == "warrior":
-            c["job__range"] = (100, 132)
-        elif self.job == "magician":
-            c["job__range"] = (200, 232)
-        elif self.job == "bowman":
-            c["job__range"] = (300, 322)
-        elif self.job == "thief":
-            c["job__range"] = (400, 422)
-        elif self.job == "pirate":
-            c["job__range"] = (500, 522)
-        elif self.job == "cygnus":
-            c["job__range"] = (1000, 1999)
-        elif self.job == "aran":
-            c["job__range"] = (2100, 2112)
+        if self.world is not None:
+            c["world"] = self.world
+        if self.job in JOB_GROUPS:
+            low, high = JOB_GROUPS[self.job]
+            if low == high:
+                c["job"] = low
+            else:
+                c["job__range"] = (low, high)
         return c
 
     @model_validator(mode="after")
@@ -111,7 +139,7 @@ class CharRankRequest(BaseModel):
         return self
 
     def __str__(self):
-        return f"{self.size}-{self.job}-{self.sort}-{self.page}"
+        return f"{self.size}-{self.job}-{self.sort}-{self.world}-{self.page}-{self.cursor}"
 
 
 class GuildItem(BaseModel):
@@ -150,6 +178,37 @@ class CharRankItem(BaseModel):
 class CharRankResponse(BaseModel):
     total: int
     items: list[CharRankItem]
+    next_cursor: Optional[str] = None
+
+
+class CharPositionRequest(BaseModel):
+    job: Literal[
+        "all",
+        "beginner",
+        "warrior",
+        "magician",
+        "bowman",
+        "thief",
+        "pirate",
+        "cygnus",
+        "aran",
+    ] = "all"
+    sort: Literal["level", "fame", "quest", "monsterbook"] = "level"
+    # None means all worlds
+    world: Optional[int] = Field(default=None, ge=0)
+    # the number of the neighbors on each side
+    radius: int = Field(default=2, ge=0, le=10)
+
+
+class CharPositionResponse(BaseModel):
+    character_id: int
+    job: str
+    sort: str
+    world: Optional[int] = None
+    rank: int
+    total: int
+    percentile: float
+    neighbors: list[CharRankItem]
 
 
 class PageInfo(BaseModel):
@@ -161,6 +220,10 @@ class PageInfo(BaseModel):
         return (self.page - 1) * self.size
 
 
+class CursorPageInfo(PageInfo, CursorArgs):
+    pass
+
+
 class GuildRankResponse(BaseModel):
     total: int
     items: list[GuildItem]
@@ -201,7 +264,35 @@ class CharListResponse(BaseModel):
 
 class CharAvatarResponse(BaseModel):
     character_id: int
+    # the url of the WEBP avatar, it's immutable since it's addressed by the outfit
     image: str
+    signature: Optional[str] = None
+
+
+class CharAvatarsRequest(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=50)
+
+
+class CharAvatarsResponse(BaseModel):
+    # characters that don't exist are omitted
+    items: list[CharAvatarResponse]
+
+
+class CharAtlasItem(BaseModel):
+    character_id: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class CharAtlasResponse(BaseModel):
+    # the digest of the atlas image, replaced by its url in the response
+    image: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    # characters that don't exist or failed to render are omitted
+    items: list[CharAtlasItem] = []
 
 
 class InvItemModel(BaseModel):
@@ -221,8 +312,75 @@ class InvItemModel(BaseModel):
     gift_from: str = Field(alias="giftFrom")
 
 
+class EquipStats(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    upgrade_slots: int = Field(alias="upgradeslots")
+    level: int
+    str_: int = Field(alias="str")
+    dex: int
+    int_: int = Field(alias="int")
+    luk: int
+    hp: int
+    mp: int
+    watk: int
+    matk: int
+    wdef: int
+    mdef: int
+    acc: int
+    avoid: int
+    hands: int
+    speed: int
+    jump: int
+    locked: int
+    vicious: int
+    item_level: int = Field(alias="itemlevel")
+    item_exp: int = Field(alias="itemexp")
+    ring_id: int = Field(alias="ringid")
+
+
+class CharEquipItem(BaseModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    id: int = Field(alias="inventoryitemid")
+    item_id: int = Field(alias="itemid")
+    position: int
+    # None means the position is not a visible slot, e.g. rings and pendants
+    slot: Optional[str] = None
+    cash: bool = False
+    owner: str
+    expiration: int
+    name: Optional[str] = None
+    icon: Optional[str] = None
+    stats: Optional[EquipStats] = None
+
+
+class CharEquipResponse(BaseModel):
+    items: list[CharEquipItem]
+
+
+class CharItemQueryArgs(BaseModel):
+    # None means all inventory types, -1 is the equipped items
+    inventory_type: Optional[int] = Field(default=None, ge=-1, le=5)
+    page: int = Field(default=1, ge=1)
+    limit: int = Field(default=100, ge=1, le=500)
+
+    @property
+    def offset(self) -> int:
+        return (self.page - 1) * self.limit
+
+
+class CharInventoryItem(InvItemModel):
+    model_config = ConfigDict(from_attributes=True, populate_by_name=True)
+
+    name: Optional[str] = None
+    icon: Optional[str] = None
+    stats: Optional[EquipStats] = None
+
+
 class CharItemResponse(BaseModel):
-    items: list[InvItemModel]
+    total: int
+    items: list[CharInventoryItem]
 
 
 class NoticeItem(BaseModel):
@@ -241,6 +399,7 @@ class NoticeItem(BaseModel):
 class NoticeListResponse(BaseModel):
     items: list[NoticeItem]
     total: int
+    next_cursor: Optional[str] = None
 
 
 class CSItemType(BaseModel):
@@ -292,7 +451,7 @@ class CSItem(BaseModel):
         return value
 
 
-class CSItemQueryArgs(BaseModel):
+class CSItemQueryArgs(CursorArgs):
     page: int = Field(default=1, ge=1)
     limit: int = Field(default=24, ge=1, le=100)
     keyword: str = ""
@@ -307,6 +466,7 @@ class CSItemQueryResponse(BaseModel):
     total: int
     count: int
     items: list[CSItem]
+    next_cursor: Optional[str] = None
 
 
 class CSItemBuyRequest(BaseModel):
@@ -320,7 +480,7 @@ class CSItemGiftRequest(BaseModel):
     birthday: str
 
 
-class LibraryQueryArgs(PageInfo):
+class LibraryQueryArgs(CursorPageInfo):
     category: str = "all"
     query: str = ""
 
@@ -335,6 +495,7 @@ class LibraryQueryResponse(BaseModel):
     size: int
     page: int
     items: list[dict]
+    next_cursor: Optional[str] = None
 
 
 class VoteRedirectResponse(BaseModel):
@@ -1,15 +1,15 @@
 import aiofiles
-from httpx import AsyncClient
 from sanic import Blueprint, Sanic
 from sanic.request import Request
-from sanic.response import HTTPResponse, json, redirect
+from sanic.response import HTTPResponse, json, redirect, text
 from sanic.views import HTTPMethodView
 
 from component import openapi, response
 from component.logger import logger
+from component.metrics import Registry, metrics
 from component.cache import Cache, Pydantic, default_cache
 from component.inject import Dependency
-from component.jinja import cache_page, render
+from component.jinja import StaticPage, cache_page, render
 from component.response import NormalResponse
 from component.throttle import RedisRateLimiter
 from component.view import JWTView, ThrottleView
@@ -25,17 +25,26 @@ from services.account.gtop100 import GTop100Service
 from services.account.invite import InviteService
 from services.account.register import RegisterService
 from services.account.smtp import SMTPError, SMTPService
-from services.game.render import MapleIoService, RenderService
+from services.game.render import RenderService, get_renderer
 
 app = Sanic.get_app(settings.app_name)
 bp = Blueprint("render", url_prefix="/", version_prefix="")
 redis_cache = default_cache.select("redis")
+index_page = StaticPage("templates/index.html", compressed=settings.compress.enable)
+
+
+@app.before_server_start
+async def load_index_page(_app: Sanic, _):
+    """load the SPA shell before serving, the frontend may not be built in development"""
+    try:
+        index_page.load()
+    except FileNotFoundError:
+        logger.warning(f"SPA shell {index_page.path} not found")
 
 
 @cache_page(60 * 60)
 async def index(request: Request, *args, **kwargs):
-    async with aiofiles.open("templates/index.html", mode="r") as f:
-        return HTTPResponse(await f.read(), content_type="text/html")
+    return index_page.response(request)
 
 
 # @bp.route("/", methods=["GET"], name="index")
@@ -264,11 +273,10 @@ class AvatarView(JWTView):
         self,
         request: Request,
         character_id: int,
-        http_client: AsyncClient,
         service: RenderService = Dependency(RenderService),
     ):
         try:
-            mis = MapleIoService(http_client)
+            mis = get_renderer()
             data = await service.render_character(mis, character_id)
         except Exception as err:
             logger.opt(exception=err).error("Failed to render character avatar")
@@ -276,6 +284,18 @@ class AvatarView(JWTView):
         return HTTPResponse(status=200, headers={"Content-Type": "image/webp"}, body=data)
 
 
+@openapi.exclude()
+async def metrics_export(request: Request):
+    """Prometheus metrics aggregated across all workers"""
+    conf = settings.metrics
+    if not conf.enable:
+        return HTTPResponse(status=404)
+    if conf.authorized and request.client_ip not in conf.authorized:
+        return HTTPResponse(status=403)
+    snapshot = await metrics.collect(redis_cache)
+    return text(Registry.render(snapshot), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 bp.add_route(index, "/", name="index")
 bp.add_route(index, "/download", name="download")
 bp.add_route(index, "/ranking", name="ranking")
@@ -289,3 +309,4 @@ bp.add_route(VoteView.as_view(), "/vote", name="vote")
 bp.add_route(Captcha.as_view(), "/register/captcha", name="captcha")
 bp.add_route(RegisterView.as_view(), "/register", name="register")
 bp.add_route(AvatarView.as_view(), "/api/avatar/<character_id:int>", name="avatar")
+bp.add_route(metrics_export, "/metrics", name="metrics")
@@ -10,12 +10,12 @@ from models.serializers.v1 import (
     CSItemQueryArgs,
     CSItemQueryResponse,
     CSPoster,
+    CursorPageInfo,
     LibraryQueryArgs,
     LibraryQueryResponse,
     LibrarySourceArgs,
     NoticeItem,
     NoticeListResponse,
-    PageInfo,
     UserName,
     VoteRedirectResponse,
 )
@@ -30,17 +30,18 @@ from .router import bp
 
 
 class NoticeListView(JWTView):
+    cache_timeout = 60
+
     @openapi.response(response.NormalResponse[NoticeListResponse])
-    @openapi.query(PageInfo)
+    @openapi.query(CursorPageInfo)
     async def get(
         self,
         request: Request,
-        vo: PageInfo = Dependency(PageInfo),
+        vo: CursorPageInfo = Dependency(CursorPageInfo),
         service: NoticeService = Dependency(NoticeService),
     ):
         """公告列表"""
-        total, items = await service.list(vo, must_display=True)
-        m = NoticeListResponse(total=total, items=items)
+        m = await service.list(vo, must_display=True)
         return response.ok(request, m.model_dump())
 
 
@@ -75,6 +76,8 @@ class CSPosterView(JWTView):
 
 
 class CSItemListView(JWTView):
+    cache_timeout = 60
+
     @openapi.response(response.NormalResponse[CSItemQueryResponse])
     @openapi.query(CSItemQueryArgs)
     async def get(
@@ -84,7 +87,7 @@ class CSItemListView(JWTView):
         service: CashShopService = Dependency(CashShopService),
     ):
         """获取商城物品列表"""
-        m = await service.search_items(vo.offset, vo.limit, vo.keyword, vo.category)
+        m = await service.search_items(vo.offset, vo.limit, vo.keyword, vo.category, vo.cursor)
         return response.ok(request, m.model_dump())
 
 
@@ -131,6 +134,8 @@ class CSItemGiftView(AuthView):
 
 
 class LibrarySearchView(JWTView):
+    cache_timeout = 300
+
     @openapi.response(response.NormalResponse[LibraryQueryResponse])
     @openapi.query(LibraryQueryArgs)
     async def get(
@@ -1,17 +1,21 @@
-import base64
 import socket
 
-from httpx import AsyncClient
-from sanic import Request
+from sanic import HTTPResponse, Request
 
 from component import openapi, response
 from component.cache import cache
+from component.response import etag_matches
 from component.inject import Dependency
 from component.view import JWTView
 from config import Settings
 from models.game import User
 from models.serializers.v1 import (
+    CharAtlasResponse,
     CharAvatarResponse,
+    CharAvatarsRequest,
+    CharAvatarsResponse,
+    CharPositionRequest,
+    CharPositionResponse,
     CharRankRequest,
     CharRankResponse,
     GameOnlineResponse,
@@ -20,7 +24,7 @@ from models.serializers.v1 import (
 )
 from services.account.info import UserService
 from services.game.rank import RankService
-from services.game.render import MapleIoService, RenderService
+from services.game.render import RenderError, RenderService, get_renderer, placeholder_avatar
 from services.rpc.service import MagicService
 
 from .base import AuthView
@@ -94,6 +98,8 @@ class OnlineView(JWTView):
 
 
 class CharRankView(JWTView):
+    cache_timeout = 60
+
     @openapi.response(response.NormalResponse[CharRankResponse])
     @openapi.query(CharRankRequest)
     async def get(
@@ -107,7 +113,63 @@ class CharRankView(JWTView):
         return response.ok(request, m.model_dump())
 
 
+class CharPositionView(JWTView):
+    cache_timeout = 60
+
+    @openapi.response(response.NormalResponse[CharPositionResponse])
+    @openapi.query(CharPositionRequest)
+    async def get(
+        self,
+        request: Request,
+        character_id: int,
+        vo: CharPositionRequest = Dependency(CharPositionRequest),
+        service: RankService = Dependency(RankService),
+    ):
+        """角色排名及前后相邻角色"""
+        m = await service.position(character_id, vo)
+        if m is None:
+            request.ctx.message = "角色不在该排行榜中"
+            return response.not_found(request)
+        return response.ok(request, m.model_dump())
+
+
+class CharRankAtlasView(JWTView):
+    @openapi.response(response.NormalResponse[CharAtlasResponse])
+    @openapi.query(CharRankRequest)
+    async def get(
+        self,
+        request: Request,
+        vo: CharRankRequest = Dependency(CharRankRequest),
+        service: RenderService = Dependency(RenderService),
+    ):
+        """排行榜页面的角色简图雪碧图及每个角色的偏移"""
+        page = await RankService.rank(vo)
+        key = await RankService.page_key(vo)
+        m = await service.atlas(get_renderer(), key, [i.id for i in page.items])
+        if m.image:
+            m.image = request.app.url_for("v1.CharAtlasImageView", digest=m.image)
+        return response.ok(request, m.model_dump())
+
+
+class CharAtlasImageView(JWTView):
+    @openapi.exclude()
+    async def get(
+        self,
+        request: Request,
+        digest: str,
+        service: RenderService = Dependency(RenderService),
+    ):
+        data = await service.atlas_image(digest)
+        if not data:
+            return HTTPResponse(status=404)
+        # the url is addressed by the content
+        headers = {"Content-Type": "image/webp", "Cache-Control": "public, max-age=31536000"}
+        return HTTPResponse(status=200, headers=headers, body=data)
+
+
 class GuildRankView(JWTView):
+    cache_timeout = 60
+
     @openapi.response(response.NormalResponse[GuildRankResponse])
     @openapi.query(PageInfo)
     async def get(
@@ -127,22 +189,78 @@ class CharAvatarView(JWTView):
         self,
         request: Request,
         character_id: int,
-        httpx: AsyncClient,
         service: RenderService = Dependency(RenderService),
     ):
-        """获取角色简图"""
-        mis = MapleIoService(httpx)
+        """获取角色简图的地址"""
         try:
-            data = await service.render_character(mis, character_id)
-        except:
-            data = b""
+            items = await service.character_outfit(character_id)
+        except RenderError as err:
+            request.ctx.message = err.message
+            return response.not_found(request)
+        signature = service.signature(items)
         m = CharAvatarResponse(
             character_id=character_id,
-            image=f"data:image/webp;base64,{base64.b64encode(data).decode()}",
+            image=request.app.url_for("v1.AvatarImageView", signature=signature),
+            signature=signature,
         )
         return response.ok(request, m.model_dump())
 
 
+class CharAvatarsView(JWTView):
+    @openapi.response(response.NormalResponse[CharAvatarsResponse])
+    @openapi.query(CharAvatarsRequest)
+    async def get(
+        self,
+        request: Request,
+        vo: CharAvatarsRequest = Dependency(CharAvatarsRequest),
+        service: RenderService = Dependency(RenderService),
+    ):
+        """批量获取角色简图的地址，ids参数可以重复传递"""
+        outfits = await service.character_outfits(vo.ids)
+        items = []
+        for character_id, outfit in outfits.items():
+            signature = service.signature(outfit)
+            items.append(
+                CharAvatarResponse(
+                    character_id=character_id,
+                    image=request.app.url_for("v1.AvatarImageView", signature=signature),
+                    signature=signature,
+                )
+            )
+        return response.ok(request, CharAvatarsResponse(items=items).model_dump())
+
+
+class AvatarImageView(JWTView):
+    @openapi.exclude()
+    async def get(
+        self,
+        request: Request,
+        signature: str,
+        service: RenderService = Dependency(RenderService),
+    ):
+        # the avatar never changes, the signature is a strong validator
+        etag = f'"{signature}"'
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return HTTPResponse(status=304, headers=headers)
+        try:
+            data = await service.render_signature(get_renderer(), signature)
+        except RenderError as err:
+            if err.status != 503:
+                return HTTPResponse(status=err.status)
+            # the renderer is unavailable, the placeholder must not be cached
+            return HTTPResponse(
+                status=200,
+                headers={"Content-Type": "image/webp", "Cache-Control": "no-store"},
+                body=placeholder_avatar(),
+            )
+        if not data:
+            return HTTPResponse(status=404)
+        return HTTPResponse(
+            status=200, headers={**headers, "Content-Type": "image/webp"}, body=data
+        )
+
+
 class EAView(AuthView):
     @openapi.response(response.NormalResponse[type(None)])
     async def post(self, request: Request):
@@ -160,5 +278,10 @@ bp.add_route(StatusView.as_view(), "/game/status")
 bp.add_route(OnlineView.as_view(), "/game/online")
 bp.add_route(EAView.as_view(), "/game/ea")
 bp.add_route(CharRankView.as_view(), "/game/character/rank")
+bp.add_route(CharPositionView.as_view(), "/game/character/rank/<character_id:int>")
+bp.add_route(CharRankAtlasView.as_view(), "/game/character/rank/atlas")
+bp.add_route(CharAtlasImageView.as_view(), "/game/character/rank/atlas/<digest:str>")
 bp.add_route(GuildRankView.as_view(), "/game/guild/rank")
 bp.add_route(CharAvatarView.as_view(), "/game/character/avatar/<character_id:int>")
+bp.add_route(CharAvatarsView.as_view(), "/game/character/avatars")
+bp.add_route(AvatarImageView.as_view(), "/game/avatar/<signature:[0-9a-f]{40}>")
@@ -8,7 +8,9 @@ from component.inject import Dependency
 from component.logger import logger
 from config import settings
 from models.serializers.v1 import (
+    CharEquipResponse,
     CharInfo,
+    CharItemQueryArgs,
     CharItemResponse,
     CharListResponse,
     CheckInRequest,
@@ -125,25 +127,45 @@ class CharView(AuthView):
 
 
 class CharItemListView(AuthView):
+    @openapi.query(CharItemQueryArgs)
     @openapi.response(response.NormalResponse[CharItemResponse])
-    async def get(self, request: Request, character_id: int):
+    async def get(
+        self,
+        request: Request,
+        character_id: int,
+        vo: CharItemQueryArgs = Dependency(CharItemQueryArgs),
+        wz: LibraryService = Dependency(LibraryService),
+    ):
         """获取角色背包物品"""
         user_service = UserService(request.ctx.user)
         try:
-            items = await user_service.character_items(character_id)
+            m = await user_service.character_items(
+                wz, character_id, vo.inventory_type, vo.offset, vo.limit
+            )
         except UserError as e:
             request.ctx.message = e.message
             return response.forbidden(request)
-        m = CharItemResponse(items=items)
-        return response.ok(request, m.model_dump())
+        # pages of more than 100 items are streamed, compressed chunk by chunk,
+        # they have no ETag and are never answered with 304
+        return await response.ok_stream(request, {"total": m.total}, m.items)
 
 
 class CharEquipView(AuthView):
-    @openapi.response(response.NormalResponse[type(None)])
-    async def get(self, request: Request, character_id: int):
+    @openapi.response(response.NormalResponse[CharEquipResponse])
+    async def get(
+        self,
+        request: Request,
+        character_id: int,
+        wz: LibraryService = Dependency(LibraryService),
+    ):
         """获取角色装备物品"""
-        # TODO Implement
-        raise NotImplementedError("暂未实现")
+        user_service = UserService(request.ctx.user)
+        try:
+            m = await user_service.character_equips(cache, wz, character_id)
+        except UserError as e:
+            request.ctx.message = e.message
+            return response.forbidden(request)
+        return response.ok(request, m.model_dump())
 
 
 bp.add_route(UserInfoView.as_view(), "/user/info")
@@ -2,15 +2,22 @@ import asyncio
 import random
 import time
 from datetime import datetime
+from typing import Optional
 
 import aiofiles
 
-from component.cache import ARLock, Cache
-from services.constant import checkin_items
-from models.game import Character, Gift, InvItem, User
-from models.serializers.v1 import CharInfo, InvItemModel
+from component.cache import ARLock, Cache, Pydantic
+from models.game import EQUIP_SLOTS, Character, Gift, InvItem, User
+from models.projection import fetch, validate_list
+from models.serializers.v1 import (
+    CharEquipItem,
+    CharEquipResponse,
+    CharInfo,
+    CharInventoryItem,
+    CharItemResponse,
+)
 from services.account.smtp import SMTPService
-from services.community.library import LibraryService, WzData
+from services.community.library import LibraryService, WzData, checkin_pool
 from services.rpc.service import MagicService
 
 
@@ -48,12 +55,10 @@ class UserService:
 
     @staticmethod
     async def random_checkin_item(wz_service: LibraryService) -> WzData:
-        while True:
-            _key = random.choice(list(checkin_items.keys()))
-            item = random.choice(checkin_items[_key])
-            wz_data = await wz_service.fetch_item(item)
-            if wz_data and wz_data.name:
-                return wz_data
+        pool = await checkin_pool.refresh(wz_service)
+        if not (wz_data := pool.sample()):
+            raise UserError("签到道具池为空", 500)
+        return wz_data
 
     async def checkin(self, cache: Cache, rpc: MagicService, character_id: int, item: WzData):
         await self.sync_from_db()
@@ -130,10 +135,7 @@ class UserService:
 
     async def character_list(self) -> list[CharInfo]:
         await self.sync_from_db()
-        items = []
-        async for char in Character.filter(accountid=self.user.id):
-            items.append(CharInfo.model_validate(char))
-        return items
+        return await fetch(Character.filter(accountid=self.user.id), CharInfo)
 
     async def character_info(self, character_id: int) -> CharInfo:
         await self.sync_from_db()
@@ -142,10 +144,56 @@ class UserService:
             raise UserError("角色不存在", 404)
         return CharInfo.model_validate(char)
 
-    async def character_items(self, character_id: int) -> list[InvItemModel]:
+    async def character_items(
+        self,
+        wz: LibraryService,
+        character_id: int,
+        inventory_type: Optional[int],
+        offset: int,
+        limit: int,
+    ) -> CharItemResponse:
+        """角色背包物品，包括装备属性与资料库中的名称、图标
+        :param inventory_type: 物品种类，None表示所有种类
+        """
         await self.sync_from_db()
-        char = await Character.filter(accountid=self.user.id, id=character_id).first()
-        if not char:
+        if not await Character.filter(accountid=self.user.id, id=character_id).exists():
+            raise UserError("角色不存在", 404)
+        queryset = InvItem.filter(characterid=character_id)
+        if inventory_type is not None:
+            queryset = queryset.filter(inventorytype=inventory_type)
+        total, rows = await asyncio.gather(
+            queryset.count(), InvItem.with_stats(character_id, inventory_type, offset, limit)
+        )
+        documents = await wz.get_doc_by_ids(list({str(row["itemid"]) for row in rows}))
+        items = validate_list(CharInventoryItem, rows)
+        for item in items:
+            if doc := documents.get(str(item.item_id)):
+                item.name, item.icon = doc.name, doc.icon
+        return CharItemResponse(total=total, items=items)
+
+    async def character_equips(
+        self, cache: Cache, wz: LibraryService, character_id: int
+    ) -> CharEquipResponse:
+        """角色穿戴的装备，包括装备属性与资料库中的名称、图标
+        结果按 背包指纹 + 资料库版本号 缓存，角色的装备变化或资料库更新后自然失效
+        """
+        await self.sync_from_db()
+        if not await Character.filter(accountid=self.user.id, id=character_id).exists():
             raise UserError("角色不存在", 404)
-        item = await InvItem.filter(characterid=character_id)
-        return [InvItemModel.model_validate(i) for i in item]
+        fingerprint, version = await asyncio.gather(
+            InvItem.fingerprint(character_id, -1), cache.get(wz.version_key, default=0)
+        )
+        key = f"character:{character_id}:equip:{version}:{fingerprint}"
+        serializer = Pydantic(CharEquipResponse)
+        if m := await cache.get(key, serializer=serializer):
+            return m
+        rows = await InvItem.with_stats(character_id, -1)
+        documents = await wz.get_doc_by_ids(list({str(row["itemid"]) for row in rows}))
+        items = validate_list(CharEquipItem, rows)
+        for item in items:
+            item.slot, item.cash = EQUIP_SLOTS.get(item.position, (None, False))
+            if doc := documents.get(str(item.item_id)):
+                item.name, item.icon = doc.name, doc.icon
+        m = CharEquipResponse(items=items)
+        await cache.set(key, m, serializer=serializer, ex=600)
+        return m
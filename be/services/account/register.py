@@ -3,10 +3,10 @@ from datetime import date, datetime
 from typing import Optional, Union
 
 import aiofiles
-from httpx import AsyncClient
 from tortoise import transactions
 
 from component.cache import Cache
+from component.upstream import get_or_init_upstream
 from config import Settings
 from models.community import Invitation
 from models.game import User
@@ -22,8 +22,7 @@ class RegisterError(Exception):
 class RegisterService:
     _char_list = list(range(48, 58)) + list(range(65, 91))
 
-    def __init__(self, http_client: AsyncClient, cache: Cache, config: Settings):
-        self.httpx = http_client
+    def __init__(self, cache: Cache, config: Settings):
         self.cache = cache.select("redis")
         self.config = config.reg_config
 
@@ -87,7 +86,8 @@ class RegisterService:
         if ip:
             payload["remoteip"] = ip
         try:
-            r = await self.httpx.post(self.config.recaptcha_url, data=payload, timeout=10)
+            upstream = get_or_init_upstream("recaptcha")
+            r = await upstream.post(self.config.recaptcha_url, data=payload)
             data = r.json()
             return data.get("success") is True
         except:
@@ -1,13 +1,25 @@
 import asyncio
+import json
+import random
 import time
 from abc import ABCMeta, abstractmethod
 from typing import Literal, Optional
 
+from bson import ObjectId
+from bson.errors import InvalidId
 from grpc.aio import AioRpcError
 from motor.motor_asyncio import AsyncIOMotorClient
 from tortoise.queryset import Q
 
 from component.cache import Cache
+from component.count import CountCache
+from component.pagination import (
+    InvalidCursor,
+    decode_cursor,
+    encode_cursor,
+    keyset,
+    next_cursor,
+)
 from models.community import CashShop, MsCommodity, MsData, MsItemCategory
 from models.game import DropData, NpcShop, NpcShopItem
 from models.serializers.v1 import LibraryQueryArgs, LibraryQueryResponse
@@ -52,7 +64,71 @@ class WzData:
         return self.data.get("attr", {})
 
 
+class CheckInPool:
+    """签到道具池
+    只保留资料库中有名字的签到道具，签到时先等概率选择分类，再在分类中等概率选择道具，
+    两次选择都是O(1)的，不需要反复查询资料库；同时预先计算每个道具的获得概率供来源查询使用
+
+    资料库的数据更新后执行 sanic inspect library_refresh 使版本号加一，
+    各worker在下一次签到时重建道具池
+
+    :param items: 分类 -> 道具id列表
+    """
+
+    def __init__(self, items: dict[str, list[str]]):
+        self.items = items
+        # None means the pool has not been verified against the library
+        self.version: Optional[int] = None
+        self.categories: list[list[str]] = []
+        self.probability: dict[str, float] = {}
+        self.documents: dict[str, WzData] = {}
+        self._lock = asyncio.Lock()
+        self._load(items)
+
+    def _load(self, items: dict[str, list[str]]):
+        self.categories = [ids for ids in items.values() if ids]
+        probability = {}
+        for ids in self.categories:
+            p = 100 / (len(ids) * len(self.categories))
+            for item_id in ids:
+                probability[item_id] = probability.get(item_id, 0) + p
+        self.probability = probability
+
+    async def refresh(self, library: "LibraryService") -> "CheckInPool":
+        """rebuild the pool if the library data has changed since the last build"""
+        version = await library.cache.get(library.version_key, default=0)
+        if version == self.version:
+            return self
+        async with self._lock:
+            if version != self.version:
+                ids = list({i for ids in self.items.values() for i in ids})
+                documents = await library.get_doc_by_ids(ids)
+                self.documents = {k: v for k, v in documents.items() if v.name}
+                self._load(
+                    {c: [i for i in ids if i in self.documents] for c, ids in self.items.items()}
+                )
+                self.version = version
+        return self
+
+    def sample(self) -> Optional[WzData]:
+        """a random item of the pool, None means the pool is empty"""
+        if not self.categories or not self.documents:
+            return None
+        return self.documents[random.choice(random.choice(self.categories))]
+
+    def chance(self, item_id: int | str) -> Optional[float]:
+        """the probability in percent of getting the item by one check-in"""
+        p = self.probability.get(str(item_id))
+        return round(p, 3) if p else None
+
+
+checkin_pool = CheckInPool(checkin_items)
+
+
 class LibraryService(metaclass=ABCMeta):
+    # increased after the library data has changed, the caches built from the library use it
+    version_key = "library:version"
+
     @abstractmethod
     async def search(self, pvo: LibraryQueryArgs) -> LibraryQueryResponse:
         raise NotImplementedError
@@ -103,14 +179,30 @@ class LibraryMongo(LibraryService):
         }
         if "all" not in pvo.category:
             query["category"] = {"$in": pvo.category.split(",")}
-        cursor = self.db.Data.find(query, {"_id": 0})
-        cursor.skip(pvo.offset).limit(pvo.size)
+        if pvo.cursor:
+            # keyset pagination on _id
+            (last_id,) = decode_cursor(pvo.cursor, 1)
+            try:
+                page_query = {**query, "_id": {"$gt": ObjectId(last_id)}}
+            except (InvalidId, TypeError):
+                raise InvalidCursor("invalid cursor")
+            cursor = self.db.Data.find(page_query).sort("_id", 1).limit(pvo.size)
+        else:
+            cursor = self.db.Data.find(query).sort("_id", 1).skip(pvo.offset).limit(pvo.size)
         total, result = await asyncio.gather(
-            self.db.Data.count_documents(query),
+            CountCache(self.cache).get_or_count(
+                "Data",
+                json.dumps(query, sort_keys=True, ensure_ascii=False),
+                lambda: self.db.Data.count_documents(query),
+            ),
             cursor.to_list(length=pvo.size),
         )
+        cursor_next = None
+        if len(result) == pvo.size:
+            cursor_next = encode_cursor([str(result[-1]["_id"])])
         for i in range(len(result)):
             item = result[i]
+            del item["_id"]
             if "info" not in item and "attr" in item:
                 item["info"] = item["attr"]
             if "attr" in item:
@@ -120,6 +212,7 @@ class LibraryMongo(LibraryService):
             size=len(result),
             page=pvo.page,
             items=result,
+            next_cursor=cursor_next,
         )
 
     async def get_doc_by_ids(self, item_ids: list[int] | list[str]) -> dict[str, WzData]:
@@ -230,28 +323,7 @@ class LibraryMongo(LibraryService):
     @staticmethod
     async def source_by_checkin(oid: int) -> tuple[Literal["checkin"], Optional[float]]:
         """Query the source of the item from the check-in system."""
-        category = [
-            "Weapon",
-            "Ring",
-            "Coat",
-            "LongCoat",
-            "Pants",
-            "Cap",
-            "Glove",
-            "Shoes",
-            "Cape",
-            "Accessory",
-        ]
-        count = len(category)
-        ans = None
-        for c in category:
-            if c not in checkin_items:
-                count -= 1
-                continue
-            if str(oid) in checkin_items[c]:
-                _ = 100 / (len(checkin_items[c]) * count)
-                ans = float(f"{_:.3f}")
-        return "checkin", ans
+        return "checkin", checkin_pool.chance(oid)
 
     async def source_by_npc_script(self, oid: int) -> tuple[Literal["npc_script"], dict]:
         """Query the source of the item from the npc script.
@@ -597,14 +669,17 @@ class LibraryRDB(LibraryService):
             q = Q(oid__contains=pvo.query) | Q(name__contains=pvo.query)
         else:
             q = Q(name__contains=pvo.query)
-        queryset = MsData.filter(q).exclude(category=MsItemCategory.Quest).order_by("oid")
+        queryset = MsData.filter(q).exclude(category=MsItemCategory.Quest)
         if "all" not in pvo.category:
             queryset = queryset.filter(category__in=pvo.category.split(","))
         result = []
-        total, rows = await asyncio.gather(
-            queryset.count(),
-            queryset.offset(pvo.offset).limit(pvo.size),
-        )
+        ordering = ("oid", "id")
+        page = queryset.order_by(*ordering).limit(pvo.size)
+        if pvo.cursor:
+            page = page.filter(keyset(ordering, decode_cursor(pvo.cursor, len(ordering))))
+        else:
+            page = page.offset(pvo.offset)
+        total, rows = await asyncio.gather(CountCache(self.cache).count(queryset), page)
         map_item = []
         for row in rows:
             item = {
@@ -624,6 +699,7 @@ class LibraryRDB(LibraryService):
             size=len(result),
             page=pvo.page,
             items=result,
+            next_cursor=next_cursor(rows, ordering, pvo.size),
         )
 
 
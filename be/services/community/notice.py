@@ -1,28 +1,42 @@
 import asyncio
 from typing import Optional
 
+from component.cache import cache
+from component.count import CountCache
+from component.pagination import decode_cursor, keyset, next_cursor
 from models.community import Notice
-from models.serializers.v1 import NoticeItem, PageInfo
+from models.serializers.v1 import CursorPageInfo, NoticeItem, NoticeListResponse
+
+cache = cache.select("redis")
 
 
 class NoticeService:
 
+    ordering = ("-create_time", "-id")
+
     @staticmethod
     async def list(
-        vo: PageInfo,
+        vo: CursorPageInfo,
         must_display: bool = False,
         must_visit: bool = False,
-    ) -> tuple[int, list[NoticeItem]]:
-        queryset = Notice.filter().order_by("-create_time")
+    ) -> NoticeListResponse:
+        queryset = Notice.filter()
         if must_display:
             queryset = queryset.filter(display=True)
         if must_visit:
             queryset = queryset.filter(visit=True)
-        total, items = await asyncio.gather(
-            queryset.count(),
-            queryset.offset(vo.offset).limit(vo.size)
+        page = queryset.order_by(*NoticeService.ordering).limit(vo.size)
+        if vo.cursor:
+            after = decode_cursor(vo.cursor, len(NoticeService.ordering))
+            page = page.filter(keyset(NoticeService.ordering, after))
+        else:
+            page = page.offset(vo.offset)
+        total, items = await asyncio.gather(CountCache(cache).count(queryset), page)
+        return NoticeListResponse(
+            total=total,
+            items=[NoticeItem.model_validate(item) for item in items],
+            next_cursor=next_cursor(items, NoticeService.ordering, vo.size),
         )
-        return total, [NoticeItem.model_validate(item) for item in items]
 
     @staticmethod
     async def get(
@@ -1,52 +1,66 @@
+from typing import Iterable
+
+
 class JobInfo:
-    _job_code: list[int] = []
-    _job_name: dict[str, list[str]] = {}
+    # code -> name of each language, a missing name means ""
+    _job_name: dict[str, dict[int, str]] = {}
+    # language -> name -> codes in insertion order
+    _job_code: dict[str, dict[str, list[int]]] = {}
     _job_parent: dict[int, int] = {}
-
-    @classmethod
-    def _add_language(cls, language="zh"):
-        if language not in cls._job_name:
-            cls._job_name[language] = [""] * len(cls._job_code)
+    # code -> the ancestors from the nearest, computed by freeze
+    _parent_chain: dict[int, tuple[int, ...]] = {}
+    _codes: dict[int, None] = {}
+    _frozen = False
 
     @classmethod
     def add(cls, code: int, name: str, parent_code=None, language="zh"):
-        cls._add_language(language)
-        if code in cls._job_code:
-            index = cls._job_code.index(code)
-            cls._job_name[language][index] = name
-        else:
-            cls._job_code.append(code)
-            for zh, vs in cls._job_name.items():
-                if zh == language:
-                    vs.append(name)
-                else:
-                    vs.append("")
+        if cls._frozen:
+            raise RuntimeError("JobInfo is frozen")
+        names = cls._job_name.setdefault(language, {})
+        by_name = cls._job_code.setdefault(language, {})
+        if code in names:
+            by_name[names[code]].remove(code)
+        names[code] = name
+        by_name.setdefault(name, []).append(code)
+        cls._codes[code] = None
         if parent_code is not None:
             cls._job_parent[code] = parent_code
 
+    @classmethod
+    def freeze(cls):
+        """precompute the parent chains, no more jobs can be added"""
+        chains = {}
+        for code in cls._codes:
+            chain, parent = [], cls._job_parent.get(code)
+            while parent is not None and parent not in chain:
+                chain.append(parent)
+                parent = cls._job_parent.get(parent)
+            chains[code] = tuple(chain)
+        cls._parent_chain = chains
+        cls._frozen = True
+
     @classmethod
     def get_by_code(cls, code, default=None, language="zh") -> str:
-        if code not in cls._job_code:
+        if code not in cls._codes:
             return default
-        cls._add_language(language)
-        index = cls._job_code.index(code)
-        return cls._job_name[language][index]
+        return cls._job_name.get(language, {}).get(code, "")
+
+    @classmethod
+    def get_by_codes(cls, codes: Iterable[int], language="zh") -> dict[int, str]:
+        """the names of a batch of codes, unknown codes are omitted"""
+        names = cls._job_name.get(language, {})
+        return {code: names.get(code, "") for code in codes if code in cls._codes}
 
     @classmethod
     def get_by_name(cls, name, language="zh") -> list[int]:
-        cls._add_language(language)
-        result = []
-        for index, n in enumerate(cls._job_name[language]):
-            if n == name:
-                result.append(cls._job_code[index])
-        return result
+        return list(cls._job_code.get(language, {}).get(name, ()))
 
     @classmethod
     def get_parent(cls, code) -> list[int]:
+        if cls._frozen and code in cls._parent_chain:
+            return list(cls._parent_chain[code])
         result = []
-        while True:
-            if code not in cls._job_parent:
-                break
+        while code in cls._job_parent:
             code = cls._job_parent[code]
             result.append(code)
         return result
@@ -131,6 +145,7 @@ JobInfo.add(2100, "aran", 2000, "en")
 JobInfo.add(2110, "aran", 2100, "en")
 JobInfo.add(2111, "aran", 2110, "en")
 JobInfo.add(2112, "aran", 2111, "en")
+JobInfo.freeze()
 
 
 JOB_CODE = {
@@ -1,15 +1,18 @@
 import asyncio
 import time
 from datetime import datetime
-from typing import Callable
+from typing import Callable, Optional
 
 from tortoise import transactions
 from tortoise.expressions import Q, F
 from tortoise.transactions import in_transaction
 
 from component.cache import Cache, Pydantic
+from component.count import CountCache
+from component.pagination import decode_cursor, keyset, next_cursor
 from models.community import ItemType, CashShop, ShoppingLog, Invitation
 from models.game import Character, User, Gift, DueyPackage, Pet, InvItem, InvEquip
+from models.projection import project, validate_list
 from models.serializers.v1 import CSItemType, CSPoster, CSItem, CSItemQueryResponse
 from services.account.invite import InviteService
 from services.account.smtp import SMTPService
@@ -28,6 +31,8 @@ class OfflineError(CashShopError):
 
 
 class CashShopService:
+    ordering = ("-rank", "-create_time", "-id")
+
     def __init__(
         self,
         rpc: MagicService,
@@ -60,18 +65,23 @@ class CashShopService:
         limit: int,
         keyword: str,
         category: str,
+        cursor: Optional[str] = None,
     ) -> CSItemQueryResponse:
         queryset = CashShop.filter(display=True)
         if keyword:
             queryset = queryset.filter(Q(title__icontains=keyword) | Q(desc__icontains=keyword))
         if category:
             queryset = queryset.filter(category=category)
-        total, cs_list = await asyncio.gather(
-            queryset.count(),
-            queryset.offset(offset).limit(limit).order_by("-rank", "-create_time", "-id"),
+        page = queryset.limit(limit).order_by(*self.ordering)
+        if cursor:
+            page = page.filter(keyset(self.ordering, decode_cursor(cursor, len(self.ordering))))
+        else:
+            page = page.offset(offset)
+        total, rows = await asyncio.gather(
+            CountCache(self.cache).count(queryset), project(page, CSItem, "rank")
         )
-        document = await self.wz.get_doc_by_ids([str(obj.itemId) for obj in cs_list])
-        items = [CSItem.model_validate(item) for item in cs_list]
+        document = await self.wz.get_doc_by_ids([str(row["itemId"]) for row in rows])
+        items = validate_list(CSItem, rows)
         for i in range(len(items)):
             item = items[i]
             doc = document.get(str(item.item_id))
@@ -85,7 +95,12 @@ class CashShopService:
             if not item.item_ico:
                 if icon := doc.icon:
                     item.item_ico = icon
-        return CSItemQueryResponse(total=total, count=len(items), items=items)
+        return CSItemQueryResponse(
+            total=total,
+            count=len(items),
+            items=items,
+            next_cursor=next_cursor(rows, self.ordering, limit),
+        )
 
     @staticmethod
     def asset_check_v1(cs: CashShop, user: User, gift: bool) -> dict:
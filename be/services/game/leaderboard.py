@@ -0,0 +1,362 @@
+"""角色排行榜
+把排行榜物化为redis有序集合，每个(排序字段, 职业组, 世界)一个有序集合，
+职业组"all"包含所有职业的角色，不指定世界的有序集合包含所有世界的角色
+
+score = 排序值 * SCALE + (SCALE - 1 - rank)，排序值相同时按游戏内排名rank升序，
+与SQL的 ORDER BY -{sort}, rank 保持一致
+
+同步时与上一次同步的快照(哈希表，角色id -> 排序值)对比，只写入发生变化的角色，
+不会出现排行榜被清空后重建的中间状态；每次有变化时版本号加一，供分页缓存作为key的一部分
+全量同步读取所有角色，增量同步只读取可能变化的角色，两者都只写入变化的部分
+
+家族排行榜数量少且整体排序，物化为一个按名次排列的列表，分页只需LRANGE；
+家族GP的指纹变化或超过最大存活时间时整体重建，重建写入临时key后RENAME替换
+"""
+
+from dataclasses import dataclass, fields
+from typing import Iterable, Optional
+
+from component.cache import Cache
+from models.serializers.v1 import JOB_GROUPS
+
+__all__ = (
+    "SORT_KEYS",
+    "SCALE",
+    "RankEntry",
+    "Leaderboard",
+    "GuildLeaderboard",
+    "job_group",
+    "make_score",
+    "split_score",
+)
+
+SORT_KEYS = ("level", "fame", "quest", "monsterbook")
+SCALE = 10_000_000
+# the number of members written by one ZADD/ZREM/HDEL command
+CHUNK = 1000
+
+
+def job_group(job: int) -> Optional[str]:
+    """the job group of the job code, None means it only appears in "all" """
+    for name, (low, high) in JOB_GROUPS.items():
+        if low <= job <= high:
+            return name
+    return None
+
+
+def make_score(value: int, rank: int) -> int:
+    return value * SCALE + SCALE - 1 - min(max(rank, 0), SCALE - 1)
+
+
+def split_score(score: float) -> tuple[int, int]:
+    """(value, rank) of the score"""
+    value, remainder = divmod(int(score), SCALE)
+    return value, SCALE - 1 - remainder
+
+
+@dataclass(frozen=True)
+class RankEntry:
+    id: int
+    job: int
+    rank: int
+    level: int
+    fame: int
+    quest: int
+    monsterbook: int
+    world: int = 0
+
+    def score(self, sort: str) -> int:
+        return make_score(getattr(self, sort), self.rank)
+
+    def boards(self) -> set[tuple[str, Optional[int]]]:
+        """(job group, world) of the leaderboards the character appears in"""
+        group = job_group(self.job)
+        jobs = ("all", group) if group else ("all",)
+        return {(job, world) for job in jobs for world in (None, self.world)}
+
+    def dumps(self) -> str:
+        return ",".join(
+            str(v)
+            for v in (
+                self.job,
+                self.rank,
+                self.level,
+                self.fame,
+                self.quest,
+                self.monsterbook,
+                self.world,
+            )
+        )
+
+    @classmethod
+    def loads(cls, character_id: int, s: str) -> "RankEntry":
+        values = list(map(int, s.split(",")))
+        if len(values) != len(fields(cls)) - 1:
+            raise ValueError(f"malformed rank entry {s}")
+        return cls(character_id, *values)
+
+
+class Leaderboard:
+    """角色排行榜
+
+    :param cache: redis缓存
+    :param prefix: key前缀
+    """
+
+    def __init__(self, cache: Cache, prefix: str = "leaderboard"):
+        self.cache = cache
+        self.prefix = prefix
+
+    def key(self, sort: str, job: str = "all", world: Optional[int] = None) -> str:
+        if world is None:
+            return self.cache.build_key(f"{self.prefix}:{sort}:{job}")
+        return self.cache.build_key(f"{self.prefix}:{sort}:{job}:w{world}")
+
+    @property
+    def snapshot_key(self) -> str:
+        return self.cache.build_key(f"{self.prefix}:snapshot")
+
+    @property
+    def version_key(self) -> str:
+        return f"{self.prefix}:version"
+
+    @property
+    def lock_key(self) -> str:
+        return f"{self.prefix}:lock"
+
+    @property
+    def synced_key(self) -> str:
+        return f"{self.prefix}:synced"
+
+    async def keys(self) -> list[str]:
+        """all the sorted sets of the leaderboard"""
+        result = []
+        for sort in SORT_KEYS:
+            result += [k async for k in self.cache.scan_iter(self.key(sort, "*"))]
+        return result
+
+    async def version(self) -> int:
+        """0 means the leaderboard has not been built"""
+        return await self.cache.get(self.version_key, default=0)
+
+    async def page(
+        self,
+        sort: str,
+        job: str,
+        offset: int,
+        size: int,
+        after: Optional[tuple[int, int]] = None,
+        world: Optional[int] = None,
+    ) -> tuple[list[tuple[int, int]], int]:
+        """(character id, score) of the page and the total number of the characters
+
+        :param after: (character id, score) of the last row of the previous page,
+            the offset is ignored when it's given
+        :param world: None means all worlds
+        """
+        key = self.key(sort, job, world)
+        async with self.cache.pipeline(transaction=False) as pipe:
+            pipe.zcard(key)
+            if after:
+                pipe.zrevrank(key, after[0])
+            else:
+                pipe.zrevrange(key, offset, offset + size - 1, withscores=True)
+            total, result = await pipe.execute()
+        if after:
+            if result is not None:
+                result = await self.cache.zrevrange(key, result + 1, result + size, withscores=True)
+            else:
+                # the character has left the leaderboard, continue from its score
+                result = await self.cache.zrevrangebyscore(
+                    key, f"({after[1]}", "-inf", start=0, num=size, withscores=True
+                )
+        return [(int(m), int(s)) for m, s in result], total
+
+    async def position(
+        self,
+        character_id: int,
+        sort: str,
+        job: str,
+        radius: int,
+        world: Optional[int] = None,
+    ) -> Optional[tuple[int, int, list[int]]]:
+        """O(log n) rank lookup by ZREVRANK
+        :return: (0-based rank, total, ids of the neighbors including the character itself),
+            None means the character is not on the leaderboard
+        """
+        key = self.key(sort, job, world)
+        async with self.cache.pipeline(transaction=False) as pipe:
+            pipe.zrevrank(key, character_id)
+            pipe.zcard(key)
+            rank, total = await pipe.execute()
+        if rank is None:
+            return None
+        members = await self.cache.zrevrange(key, max(rank - radius, 0), rank + radius)
+        return rank, total, [int(m) for m in members]
+
+    async def values(self, ids: Iterable[int], sort: str) -> dict[int, int]:
+        """the values of the sort key of the characters"""
+        ids = list(ids)
+        if not ids:
+            return {}
+        key = self.key(sort)
+        async with self.cache.pipeline(transaction=False) as pipe:
+            for character_id in ids:
+                pipe.zscore(key, character_id)
+            scores = await pipe.execute()
+        return {i: int(s // SCALE) for i, s in zip(ids, scores) if s is not None}
+
+    async def acquire(self, timeout: int) -> bool:
+        """only one worker is allowed to sync in the timeout seconds"""
+        return bool(await self.cache.set(self.lock_key, 1, ex=timeout, nx=True))
+
+    async def last_sync(self) -> tuple[float, float]:
+        """(timestamp of the last sync, timestamp of the last full sync), 0 means never"""
+        synced = await self.cache.get(self.synced_key, default={})
+        return synced.get("at", 0), synced.get("full", 0)
+
+    async def mark_synced(self, at: float, full: bool) -> None:
+        _, full_at = await self.last_sync()
+        await self.cache.set(self.synced_key, {"at": at, "full": at if full else full_at})
+
+    async def sync(self, entries: Iterable[RankEntry]) -> int:
+        """apply the differences between the entries of all the ranked characters
+        and the last snapshot, the characters missing from the entries are removed
+        :return: the number of the changed characters
+        """
+        previous = {}
+        if await self.version():
+            try:
+                previous = self._loads((await self.cache.hgetall(self.snapshot_key)).items())
+                rebuild = False
+            except ValueError:
+                # the snapshot was written in another format
+                rebuild = True
+        else:
+            # the sorted sets may have been evicted together with the version
+            rebuild = True
+        if rebuild:
+            previous = {}
+            await self.cache.current_db.delete(*await self.keys(), self.snapshot_key)
+        return await self._apply(previous, entries)
+
+    async def update(self, ids: list[int], entries: Iterable[RankEntry]) -> Optional[int]:
+        """apply the differences of the characters only, the ones missing from the entries
+        (deleted or became GM) are removed
+        :return: the number of the changed characters, None means a full sync is required
+        """
+        if not await self.version():
+            return None
+        if not ids:
+            return 0
+        values = await self.cache.hmget(self.snapshot_key, [str(i) for i in ids])
+        try:
+            previous = self._loads((i, v) for i, v in zip(ids, values) if v is not None)
+        except ValueError:
+            return None
+        return await self._apply(previous, entries)
+
+    @staticmethod
+    def _loads(items: Iterable[tuple]) -> dict[int, RankEntry]:
+        result = {}
+        for k, v in items:
+            k, v = (x.decode() if isinstance(x, bytes) else x for x in (k, v))
+            result[int(k)] = RankEntry.loads(int(k), v)
+        return result
+
+    async def _apply(self, previous: dict[int, RankEntry], entries: Iterable[RankEntry]) -> int:
+        """write the differences, the characters left in previous are removed"""
+        adds: dict[str, dict[str, int]] = {}
+        rems: dict[str, list[str]] = {}
+        snapshot: dict[str, str] = {}
+        changed = 0
+        for entry in entries:
+            old = previous.pop(entry.id, None)
+            if old == entry:
+                continue
+            changed += 1
+            member, boards = str(entry.id), entry.boards()
+            for sort in SORT_KEYS:
+                score = entry.score(sort)
+                for job, world in boards:
+                    adds.setdefault(self.key(sort, job, world), {})[member] = score
+            if old:
+                for job, world in old.boards() - boards:
+                    for sort in SORT_KEYS:
+                        rems.setdefault(self.key(sort, job, world), []).append(member)
+            snapshot[member] = entry.dumps()
+        # deleted characters or characters who became GM
+        for old in previous.values():
+            changed += 1
+            for job, world in old.boards():
+                for sort in SORT_KEYS:
+                    rems.setdefault(self.key(sort, job, world), []).append(str(old.id))
+        if not changed:
+            return 0
+
+        async with self.cache.pipeline(transaction=False) as pipe:
+            for key, mapping in adds.items():
+                items = list(mapping.items())
+                for i in range(0, len(items), CHUNK):
+                    pipe.zadd(key, dict(items[i : i + CHUNK]))
+            for key, members in rems.items():
+                for i in range(0, len(members), CHUNK):
+                    pipe.zrem(key, *members[i : i + CHUNK])
+            items = list(snapshot.items())
+            for i in range(0, len(items), CHUNK):
+                pipe.hset(self.snapshot_key, mapping=dict(items[i : i + CHUNK]))
+            removed = [str(old.id) for old in previous.values()]
+            for i in range(0, len(removed), CHUNK):
+                pipe.hdel(self.snapshot_key, *removed[i : i + CHUNK])
+            pipe.incr(self.cache.build_key(self.version_key))
+            await pipe.execute()
+        return changed
+
+
+class GuildLeaderboard:
+    """家族排行榜
+
+    :param cache: redis缓存
+    :param prefix: key前缀
+    """
+
+    def __init__(self, cache: Cache, prefix: str = "leaderboard:guild"):
+        self.cache = cache
+        self.prefix = prefix
+
+    @property
+    def key(self) -> str:
+        return self.cache.build_key(f"{self.prefix}:items")
+
+    @property
+    def fingerprint_key(self) -> str:
+        return f"{self.prefix}:fingerprint"
+
+    async def fingerprint(self) -> Optional[str]:
+        """the fingerprint of the last build, None means a rebuild is required"""
+        return await self.cache.get(self.fingerprint_key)
+
+    async def page(self, offset: int, size: int) -> Optional[tuple[list[str], int]]:
+        """the serialized items of the page and the total, None means it has not been built"""
+        async with self.cache.pipeline(transaction=False) as pipe:
+            pipe.exists(self.key)
+            pipe.lrange(self.key, offset, offset + size - 1)
+            pipe.llen(self.key)
+            exists, items, total = await pipe.execute()
+        if not exists:
+            return None
+        return [i.decode() if isinstance(i, bytes) else i for i in items], total
+
+    async def replace(self, items: list[str], fingerprint: str, max_age: int) -> None:
+        """atomically replace the leaderboard with the serialized items in rank order"""
+        tmp = f"{self.key}:tmp"
+        async with self.cache.pipeline(transaction=True) as pipe:
+            pipe.delete(tmp)
+            for i in range(0, len(items), CHUNK):
+                pipe.rpush(tmp, *items[i : i + CHUNK])
+            if items:
+                pipe.rename(tmp, self.key)
+            else:
+                pipe.delete(self.key)
+            pipe.set(self.cache.build_key(self.fingerprint_key), fingerprint, ex=max_age)
+            await pipe.execute()
@@ -1,11 +1,27 @@
 import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import Optional
 
 from tortoise.functions import Sum, Count
 
 from component.cache import cache, Pydantic
+from component.count import CountCache
+from component.pagination import decode_cursor, encode_cursor, keyset
 from services.constant import JobInfo
-from models.game import MonsterBook, QuestStatus, Character, Guild, Alliance
+from services.game.leaderboard import (
+    GuildLeaderboard,
+    Leaderboard,
+    RankEntry,
+    make_score,
+    split_score,
+)
+from models.game import MonsterBook, QuestStatus, Character, Guild, Alliance, User
+from models.projection import validate_list
 from models.serializers.v1 import (
+    CharPositionRequest,
+    CharPositionResponse,
     CharRankRequest,
     CharRankResponse,
     CharRankItem,
@@ -15,21 +31,39 @@ from models.serializers.v1 import (
 
 cache = cache.select("redis")
 
+# the columns of the characters required by CharRankItem
+RANK_COLUMNS = ("id", "name", "level", "job", "jobRank", "fame", "rank", "guildid")
+
 
 class RankService:
     def __init__(self):
         self.cache = cache
 
+    @staticmethod
+    async def query_monster_book_level(characters: Optional[list[int]] = None) -> dict[str, int]:
+        queryset = MonsterBook.filter()
+        if characters is not None:
+            queryset = queryset.filter(charid__in=characters)
+        queryset = queryset.annotate(count=Sum("level")).group_by("charid")
+        queryset = queryset.order_by("-count").values("charid", "count")
+        return {str(item["charid"]): item["count"] async for item in queryset}
+
+    @staticmethod
+    async def query_quest_completed(characters: Optional[list[int]] = None) -> dict[str, int]:
+        queryset = QuestStatus.filter(completed=1)
+        if characters is not None:
+            queryset = queryset.filter(characterid__in=characters)
+        queryset = queryset.annotate(count=Count("queststatusid")).group_by("characterid")
+        queryset = queryset.order_by("-count").values("characterid", "count")
+        return {str(item["characterid"]): item["count"] async for item in queryset}
+
     @classmethod
     @cache.cache_fn(expire=900, format_key="RankService:stat_monster_book")
     async def stat_monster_book_level(cls) -> dict[str, int]:
         """Statistic of the monster book card levels
         :return: {character_id: card_number}
         """
-        queryset = MonsterBook.filter()
-        queryset = queryset.annotate(count=Sum("level")).group_by("charid")
-        queryset = queryset.order_by("-count").values("charid", "count")
-        return {str(item["charid"]): item["count"] async for item in queryset}
+        return await cls.query_monster_book_level()
 
     @classmethod
     @cache.cache_fn(expire=900, format_key="RankService:stat_quest_completed")
@@ -37,16 +71,188 @@ class RankService:
         """Statistic on the number of completed quests
         :return: {character_id: quest_number}
         """
-        queryset = QuestStatus.filter(completed=1)
-        queryset = queryset.annotate(count=Count("queststatusid")).group_by("characterid")
-        queryset = queryset.order_by("-count").values("characterid", "count")
-        return {str(item["characterid"]): item["count"] async for item in queryset}
+        return await cls.query_quest_completed()
+
+    @classmethod
+    async def sync_leaderboard(cls, full_interval: int) -> int:
+        """Write the latest rankings into the leaderboard, only the changed characters are written
+
+        The rankings of a character only change while it's online, so an incremental sync reads
+        the characters logged out since the last sync and the ones still online. A full sync scans
+        all the characters, quests and monster book cards, it runs when the leaderboard is empty
+        or the last full sync is older than full_interval seconds, and also catches the deleted
+        characters and the changes made while the characters were offline.
+        :param full_interval: the maximum seconds between two full syncs
+        :return: the number of the changed characters
+        """
+        board = Leaderboard(cache)
+        now = time.time()
+        synced_at, full_at = await board.last_sync()
+        changed = None
+        if synced_at and now - full_at < full_interval:
+            # a margin for the clock skew between the database and the workers
+            ids = await cls.changed_characters(datetime.fromtimestamp(synced_at - 60))
+            changed = await board.update(ids, await cls.rank_entries(ids))
+        if changed is None:
+            changed = await board.sync(await cls.rank_entries())
+            await board.mark_synced(now, full=True)
+        else:
+            await board.mark_synced(now, full=False)
+        return changed
+
+    @staticmethod
+    async def changed_characters(since: datetime) -> list[int]:
+        """ids of the characters whose rankings may have changed since the time"""
+        ids = set(await Character.filter(lastLogoutTime__gte=since).values_list("id", flat=True))
+        online = await User.filter(loggedin__gt=0).values_list("id", flat=True)
+        if online:
+            ids.update(await Character.filter(accountid__in=online).values_list("id", flat=True))
+        return sorted(ids)
+
+    @classmethod
+    async def rank_entries(cls, characters: Optional[list[int]] = None) -> list[RankEntry]:
+        """the rankings of the characters except GMs, None means all the characters"""
+        if characters is not None and not characters:
+            return []
+        queryset = Character.filter(gm__lt=2)
+        if characters is not None:
+            queryset = queryset.filter(id__in=characters)
+        quest_stat, mb_stat, chars = await asyncio.gather(
+            cls.query_quest_completed(characters),
+            cls.query_monster_book_level(characters),
+            queryset.values_list("id", "job", "rank", "level", "fame", "world"),
+        )
+        return [
+            RankEntry(
+                id=cid,
+                job=job,
+                rank=rank,
+                level=level,
+                fame=fame,
+                quest=quest_stat.get(str(cid), 0),
+                monsterbook=mb_stat.get(str(cid), 0),
+                world=world,
+            )
+            for cid, job, rank, level, fame, world in chars
+        ]
 
     @staticmethod
-    @cache.cache_fn(expire=300, serializer=Pydantic(CharRankResponse))
     async def rank(pvo: CharRankRequest) -> CharRankResponse:
-        cond = pvo.cond
+        # the pages are cached per leaderboard version, a sync invalidates them at once
+        version = await Leaderboard(cache).version()
+        return await RankService.rank_page(pvo, version)
+
+    @staticmethod
+    async def page_key(pvo: CharRankRequest) -> str:
+        """identifies a rank page, it changes whenever the cached page is invalidated"""
+        return f"{await Leaderboard(cache).version()}:{pvo}"
+
+    @staticmethod
+    @cache.cache_fn(expire=300, serializer=Pydantic(CharRankResponse))
+    async def rank_page(pvo: CharRankRequest, version: int) -> CharRankResponse:
         offset = (pvo.page - 1) * pvo.size
+        # the cursor is (character id, score) of the last row of the previous page
+        after = decode_cursor(pvo.cursor, 2) if pvo.cursor else None
+        cursor = None
+        if version:
+            board = Leaderboard(cache)
+            rows, total = await board.page(pvo.sort, pvo.job, offset, pvo.size, after, pvo.world)
+            items = await RankService.ranked_items(board, [cid for cid, _ in rows])
+            if len(rows) == pvo.size:
+                cursor = encode_cursor(rows[-1])
+        else:
+            # the leaderboard has not been built yet
+            total, chars, quest_stat, mb_stat = await RankService.rank_by_sql(pvo, offset, after)
+            items = await RankService.build_items(chars, quest_stat, mb_stat)
+            if len(items) == pvo.size:
+                last = items[-1]
+                value = {
+                    "level": last.level,
+                    "fame": last.fame,
+                    "quest": last.quest_count,
+                    "monsterbook": last.monster_book,
+                }[pvo.sort]
+                cursor = encode_cursor([last.id, make_score(value, last.rank)])
+        return CharRankResponse(total=total, items=items, next_cursor=cursor)
+
+    @staticmethod
+    async def position(
+        character_id: int, pvo: CharPositionRequest
+    ) -> Optional[CharPositionResponse]:
+        """The rank of the character and its neighbors, None means the character isn't ranked"""
+        version = await Leaderboard(cache).version()
+        if not version:
+            return None
+        return await RankService.position_at(character_id, pvo, version)
+
+    @staticmethod
+    @cache.cache_fn(expire=300, serializer=Pydantic(CharPositionResponse), skip_null=True)
+    async def position_at(
+        character_id: int, pvo: CharPositionRequest, version: int
+    ) -> Optional[CharPositionResponse]:
+        board = Leaderboard(cache)
+        found = await board.position(character_id, pvo.sort, pvo.job, pvo.radius, pvo.world)
+        if found is None:
+            return None
+        rank, total, ids = found
+        return CharPositionResponse(
+            character_id=character_id,
+            job=pvo.job,
+            sort=pvo.sort,
+            world=pvo.world,
+            rank=rank + 1,
+            total=total,
+            # the share of the characters ranked behind
+            percentile=round((total - rank - 1) / total * 100, 2),
+            neighbors=await RankService.ranked_items(board, ids),
+        )
+
+    @staticmethod
+    async def ranked_items(board: Leaderboard, ids: list[int]) -> list[CharRankItem]:
+        """items of the characters in the order of ids, the counts are read from the leaderboard"""
+        chars, quest_stat, mb_stat = await asyncio.gather(
+            Character.filter(id__in=ids).values(*RANK_COLUMNS),
+            board.values(ids, "quest"),
+            board.values(ids, "monsterbook"),
+        )
+        position = {cid: i for i, cid in enumerate(ids)}
+        chars.sort(key=lambda x: position[x["id"]])
+        quest_stat = {str(k): v for k, v in quest_stat.items()}
+        mb_stat = {str(k): v for k, v in mb_stat.items()}
+        return await RankService.build_items(chars, quest_stat, mb_stat)
+
+    @staticmethod
+    async def build_items(
+        chars: list[dict], quest_stat: dict[str, int], mb_stat: dict[str, int]
+    ) -> list[CharRankItem]:
+        """:param chars: the RANK_COLUMNS of the characters"""
+        guilds = {char["guildid"] for char in chars}
+        guild_dict = {g.guildid: g for g in await Guild.filter(guildid__in=guilds)}
+        job_names = JobInfo.get_by_codes({char["job"] for char in chars})
+        rows = []
+        for char in chars:
+            guild = guild_dict.get(char["guildid"])
+            rows.append(
+                {
+                    "id": char["id"],
+                    "name": char["name"],
+                    "level": char["level"],
+                    "job": char["job"],
+                    "job_rank": char["jobRank"],
+                    "fame": char["fame"],
+                    "rank": char["rank"],
+                    "job_name": job_names.get(char["job"], char["job"]),
+                    "guild_name": guild.name if guild else "",
+                    "guild": GuildItem.model_validate(guild) if guild else None,
+                    "quest_count": quest_stat.get(str(char["id"]), 0),
+                    "monster_book": mb_stat.get(str(char["id"]), 0),
+                }
+            )
+        return validate_list(CharRankItem, rows)
+
+    @staticmethod
+    async def rank_by_sql(pvo: CharRankRequest, offset: int, after: Optional[list] = None):
+        cond = pvo.cond
         quest_stat = await RankService.stat_quest_completed()
         mb_stat = await RankService.stat_monster_book_level()
         if pvo.sort in {"quest", "monsterbook"}:
@@ -54,63 +260,90 @@ class RankService:
                 ids = list(quest_stat.keys())
             else:
                 ids = list(mb_stat.keys())
-            if pvo.job == "all":
+            position = {cid: i for i, cid in enumerate(ids)}
+            # without a job or world filter the page can be sliced before the query
+            unfiltered = pvo.job == "all" and pvo.world is None
+            if after:
+                offset = position.get(str(after[0]), -1) + 1
+            if unfiltered:
                 ids = ids[offset : offset + pvo.size]
             total, chars = await asyncio.gather(
-                Character.filter(**cond).count(), Character.filter(**cond, id__in=ids)
+                CountCache(cache).count(Character.filter(**cond)),
+                Character.filter(**cond, id__in=ids).values(*RANK_COLUMNS),
             )
-            chars.sort(key=lambda x: ids.index(str(x.id)))
-            if pvo.job != "all":
+            chars.sort(key=lambda x: position[str(x["id"])])
+            if not unfiltered:
+                if after:
+                    offset = next((i + 1 for i, c in enumerate(chars) if c["id"] == after[0]), 0)
                 chars = chars[offset : offset + pvo.size]
         else:
             queryset = Character.filter(**cond)
+            ordering = (f"-{pvo.sort}", "rank", "id")
+            page = queryset.order_by(*ordering).limit(pvo.size)
+            if after:
+                value, rank = split_score(after[1])
+                page = page.filter(keyset(ordering, (value, rank, after[0])))
+            else:
+                page = page.offset(offset)
             total, chars = await asyncio.gather(
-                queryset.count(),
-                queryset.order_by(f"-{pvo.sort}", "rank").offset(offset).limit(pvo.size),
-            )
-        guilds = {char.guildid for char in chars}
-        guild_dict = {g.guildid: g for g in await Guild.filter(guildid__in=guilds)}
-        items = []
-        for char in chars:
-            guild = guild_dict.get(char.guildid)
-            items.append(
-                CharRankItem(
-                    id=char.id,
-                    name=char.name,
-                    level=char.level,
-                    job=char.job,
-                    job_rank=char.jobRank,
-                    fame=char.fame,
-                    rank=char.rank,
-                    job_name=JobInfo.get_by_code(char.job, char.job),
-                    guild_name=guild.name if guild else "",
-                    guild=GuildItem.model_validate(guild) if guild else None,
-                    quest_count=quest_stat.get(str(char.id), 0),
-                    monster_book=mb_stat.get(str(char.id), 0),
-                )
+                CountCache(cache).count(queryset), page.values(*RANK_COLUMNS)
             )
-        return CharRankResponse(total=total, items=items)
+        return total, chars, quest_stat, mb_stat
 
     @staticmethod
-    @cache.cache_fn(expire=300, serializer=Pydantic(GuildRankResponse))
-    async def guild_rank(page: int, size: int):
+    async def guild_rank(page: int, size: int) -> GuildRankResponse:
         """Guild Rank"""
         offset = (page - 1) * size
-        total, guilds = await asyncio.gather(Guild.all().count(), Guild.get_top_n(100))
-        sort_guilds = guilds[offset : offset + size]
-        leaders, alliances, members = await asyncio.gather(
-            Character.filter(id__in=[guild.leader for guild in guilds]).all(),
-            Alliance.filter(id__in=[guild.allianceId for guild in guilds]).all(),
-            Character.filter(guildid__in={guild.guildid for guild in sort_guilds})
-            .group_by("guildid").annotate(cnt=Count("id")).values("guildid", "cnt"),
+        found = await GuildLeaderboard(cache).page(offset, size)
+        if found is None:
+            # the leaderboard has not been built yet
+            return await RankService.guild_rank_by_sql(page, size)
+        items, total = found
+        return GuildRankResponse(
+            total=total, items=[GuildItem.model_validate_json(item) for item in items]
+        )
+
+    @staticmethod
+    @cache.cache_fn(expire=300, serializer=Pydantic(GuildRankResponse))
+    async def guild_rank_by_sql(page: int, size: int) -> GuildRankResponse:
+        offset = (page - 1) * size
+        # the same top guilds as the leaderboard, so the total doesn't change after the first build
+        guilds = await Guild.get_top_n()
+        items = await RankService.build_guild_items(guilds[offset : offset + size])
+        return GuildRankResponse(total=len(guilds), items=items)
+
+    @staticmethod
+    async def build_guild_items(guilds: list[Guild]) -> list[GuildItem]:
+        """guilds with member counts -> items with the leader and alliance names"""
+        leaders, alliances = await asyncio.gather(
+            Character.filter(id__in={guild.leader for guild in guilds}).values_list("id", "name"),
+            Alliance.filter(id__in={guild.allianceId for guild in guilds}).values_list(
+                "id", "name"
+            ),
         )
-        leader_name_dict = {l.id: l.name for l in leaders}
-        alliance_name_dict = {a.id: a.name for a in alliances}
-        member_count_dict = {m["guildid"]: m["cnt"] for m in members}
+        leader_name_dict, alliance_name_dict = dict(leaders), dict(alliances)
         items = []
-        for guild in sort_guilds:
+        for guild in guilds:
             guild.leader_name = leader_name_dict.get(guild.leader, "")
             guild.alliance_name = alliance_name_dict.get(guild.allianceId, "")
-            guild.member = member_count_dict.get(guild.guildid, 0)
             items.append(GuildItem.model_validate(guild))
-        return GuildRankResponse(total=total, items=items)
+        return items
+
+    @staticmethod
+    async def guild_fingerprint() -> str:
+        """changes whenever a guild is created, disbanded or its GP changes"""
+        rows = await Guild.all().order_by("guildid").values_list("guildid", "GP")
+        return hashlib.sha1(repr(rows).encode()).hexdigest()
+
+    @classmethod
+    async def sync_guild_leaderboard(cls, max_age: int = 3600) -> bool:
+        """Rebuild the guild leaderboard when the GP of any guild changes or it's older than max_age
+        :return: whether it's rebuilt
+        """
+        board = GuildLeaderboard(cache)
+        fingerprint = await cls.guild_fingerprint()
+        if await board.fingerprint() == fingerprint:
+            return False
+        items = await cls.build_guild_items(await Guild.get_top_n())
+        await board.replace([item.model_dump_json() for item in items], fingerprint, max_age)
+        return True
@@ -1,13 +1,24 @@
+import asyncio
 import gzip
+import hashlib
+import io
+import json
+import os
+import time
+from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
 from urllib import parse
-import io
 
-from httpx import AsyncClient
 from PIL import Image
 
-from component.cache import Cache, PyObj
-from models.game import Character
+from component.cache import Cache, Pydantic, PyObj
+from component.upstream import UpstreamUnavailable, get_or_init_upstream
+from config import settings
+from models.game import Character, InvItem
+from models.serializers.v1 import CharAtlasItem, CharAtlasResponse
+from services.game.transcode import TranscodeError, get_or_init_transcoder
 
 
 @dataclass
@@ -16,14 +27,27 @@ class MapleItem:
     version: str = "253"
 
 
-class MapleIoService:
+class AvatarRenderer(metaclass=ABCMeta):
+    """renders the items of an outfit into a PNG image"""
+
+    name: str = ""
+
+    @abstractmethod
+    async def character_avatar(self, items: list[MapleItem]) -> bytes:
+        raise NotImplementedError
+
+
+class MapleIoService(AvatarRenderer):
+    name = "maplestory.io"
     host = "https://maplestory.io"
+    semaphore: Optional[asyncio.Semaphore] = None
 
-    def __init__(self, client: AsyncClient):
-        self.client = client
+    def __init__(self):
+        # the pooled client configured by [upstreams.maplestory]
+        self.upstream = get_or_init_upstream("maplestory", self.host)
 
     def character_avatar_url(self, items: list[MapleItem]) -> str:
-        url = self.host + "/api/character/"
+        url = "/api/character/"
         items_str = []
         for item in items:
             items_str.append('{"itemId":%s,"version":"%s"}' % (item.itemId, item.version))
@@ -33,13 +57,126 @@ class MapleIoService:
         url += items_uri
         return url
 
+    @classmethod
+    def get_semaphore(cls) -> asyncio.Semaphore:
+        """limits the concurrent upstream calls of the worker"""
+        if cls.semaphore is None:
+            cls.semaphore = asyncio.Semaphore(settings.render.upstream_concurrency)
+        return cls.semaphore
+
     async def character_avatar(self, items: list[MapleItem]) -> bytes:
         url = self.character_avatar_url(items)
-        response = await self.client.get(url)
+        async with self.get_semaphore():
+            response = await self.upstream.get(url)
         response.raise_for_status()
         return response.content
 
 
+@dataclass(frozen=True)
+class Sprite:
+    path: str
+    # layers with a smaller z are drawn first
+    z: int
+    # the point of the sprite placed on the origin of the canvas
+    anchor: tuple[int, int]
+
+
+def compose_sprites(
+    layers: list[tuple[str, int, int]], canvas: tuple[int, int]
+) -> tuple[bytes, float]:
+    """paste the sprites on a transparent canvas in order, runs in the transcoding pool
+    :param layers: (path, x, y) of each sprite from the bottom layer
+    :return: the PNG bytes and the seconds spent
+    """
+    start = time.perf_counter()
+    image = Image.new("RGBA", canvas, (0, 0, 0, 0))
+    for path, x, y in layers:
+        layer = Image.new("RGBA", canvas, (0, 0, 0, 0))
+        with Image.open(path) as sprite:
+            # the sprite may be partly outside of the canvas
+            layer.paste(sprite.convert("RGBA"), (x, y))
+        image = Image.alpha_composite(image, layer)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+class LocalSpriteRenderer(AvatarRenderer):
+    """从本地精灵图资源包合成角色图像，不依赖maplestory.io
+
+    资源包目录下的index.json描述画布与每个道具的精灵图：
+        {
+            "canvas": [宽, 高],
+            "origin": [x, y],
+            "items": {"道具id": {"file": "相对路径.png", "z": 图层顺序, "anchor": [x, y]}}
+        }
+    精灵图的anchor点对齐到画布的origin点，z小的图层先绘制；
+    与maplestory.io一致，皮肤id(小于10000)同时绘制 1+皮肤id 的头部，资源包中没有的道具会被忽略
+
+    :param root: 资源包目录
+    """
+
+    name = "local"
+    _packs: dict[str, tuple[tuple[int, int], tuple[int, int], dict[int, Sprite]]] = {}
+
+    def __init__(self, root: str):
+        self.root = root
+        self.canvas, self.origin, self.sprites = self.load(root)
+
+    @classmethod
+    def load(cls, root: str) -> tuple[tuple[int, int], tuple[int, int], dict[int, Sprite]]:
+        """the index of the pack, loaded once per worker"""
+        if root not in cls._packs:
+            with open(os.path.join(root, "index.json"), encoding="utf-8") as f:
+                index = json.load(f)
+            sprites = {
+                int(item_id): Sprite(
+                    path=os.path.join(root, meta["file"]),
+                    z=meta.get("z", 0),
+                    anchor=tuple(meta.get("anchor", (0, 0))),
+                )
+                for item_id, meta in index["items"].items()
+            }
+            cls._packs[root] = (tuple(index["canvas"]), tuple(index["origin"]), sprites)
+        return cls._packs[root]
+
+    def layers(self, items: list[MapleItem]) -> list[tuple[str, int, int]]:
+        item_ids = []
+        for item in items:
+            item_ids.append(item.itemId)
+            if item.itemId < 10000:
+                item_ids.append(int(f"1{item.itemId}"))
+        sprites = [self.sprites[i] for i in item_ids if i in self.sprites]
+        sprites.sort(key=lambda x: x.z)
+        ox, oy = self.origin
+        return [(s.path, ox - s.anchor[0], oy - s.anchor[1]) for s in sprites]
+
+    async def character_avatar(self, items: list[MapleItem]) -> bytes:
+        layers = self.layers(items)
+        if not layers:
+            raise RenderError("角色渲染失败", 500)
+        try:
+            data, _ = await get_or_init_transcoder().submit(compose_sprites, layers, self.canvas)
+        except TranscodeError as err:
+            raise RenderError(err.message, err.status) from err
+        return data
+
+
+def get_renderer() -> AvatarRenderer:
+    """the avatar renderer selected by render.renderer"""
+    if settings.render.renderer == LocalSpriteRenderer.name:
+        return LocalSpriteRenderer(settings.render.sprite_root)
+    return MapleIoService()
+
+
+@lru_cache(maxsize=1)
+def placeholder_avatar() -> bytes:
+    """a transparent WEBP served while the renderer is unavailable"""
+    buffer = io.BytesIO()
+    Image.new("RGBA", (1, 1), (0, 0, 0, 0)).save(buffer, format="WEBP", lossless=True)
+    return buffer.getvalue()
+
+
 class RenderError(Exception):
     def __init__(self, message: str, status: int):
         self.message = message
@@ -55,8 +192,19 @@ class RenderService:
         1442223,
     }
 
+    # the rendered images are addressed by the outfit, so they never become stale
+    avatar_expire = 60 * 60 * 24 * 7
+    # the outfit of a character is refreshed after it expires
+    pointer_expire = 900
+    # the atlas of a rank page, the page key changes with the leaderboard version
+    atlas_expire = 300
+
+    # signature -> the render in progress in this worker
+    _rendering: dict[str, asyncio.Future] = {}
+
     def __init__(self, cache: Cache = None):
-        self.cache = cache
+        # the images are shared by all workers
+        self.cache = cache.select("redis") if cache else None
 
     @classmethod
     def dumps(cls, data: bytes) -> bytes:
@@ -66,38 +214,238 @@ class RenderService:
     def loads(cls, data: bytes) -> bytes:
         return cls.decompress(data)
 
-    async def render_character(self, serv: MapleIoService, character_id: int) -> bytes:
+    @classmethod
+    def make_outfit(cls, char: Character, equips: dict[str, InvItem]) -> list[MapleItem]:
+        """the normalized items rendered for the character, sorted by item id"""
+        equip = {
+            "Skin": f"200{char.skincolor}",
+            "Hair": str(char.hair),
+            "Face": str(char.face),
+            **{k: v.itemid for k, v in equips.items()},
+        }
+        # When there is no weapon, the equipment is transparent by default
+        # to avoid rendering failure
+        equip["Weapon"] = equip.get("Weapon", "1702224")
+        item_ids = {int(v) for v in equip.values()} - cls.not_support_items
+        return [MapleItem(itemId=i) for i in sorted(item_ids)]
+
+    async def outfit(self, character_id: int) -> list[MapleItem]:
+        """the normalized items rendered for the character, sorted by item id"""
+        char = await Character.filter(id=character_id).first()
+        if not char:
+            raise RenderError("Character does not exist", 404)
+        return self.make_outfit(char, await char.show_equip_info())
+
+    @staticmethod
+    def dumps_outfit(items: list[MapleItem]) -> str:
+        return ",".join(f"{i.itemId}:{i.version}" for i in sorted(items, key=lambda x: x.itemId))
+
+    @staticmethod
+    def loads_outfit(data: str) -> list[MapleItem]:
+        items = []
+        for part in data.split(","):
+            item_id, version = part.split(":")
+            items.append(MapleItem(itemId=int(item_id), version=version))
+        return items
+
+    @classmethod
+    def signature(cls, items: list[MapleItem]) -> str:
+        """the content address of the avatar, characters with the same outfit share it,
+        the renderer is part of the address since the renderers draw differently
+        """
+        data = f"{settings.render.renderer}|{cls.dumps_outfit(items)}"
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    @staticmethod
+    def image_key(signature: str) -> str:
+        return f"Render:avatar:{signature}"
+
+    @staticmethod
+    def pointer_key(character_id: int) -> str:
+        return f"Render:avatar:character:{character_id}"
+
+    @staticmethod
+    def outfit_key(signature: str) -> str:
+        return f"Render:avatar:outfit:{signature}"
+
+    async def _render(self, serv: AvatarRenderer, items: list[MapleItem]) -> bytes:
+        try:
+            data = await serv.character_avatar(items)
+        except RenderError:
+            raise
+        except UpstreamUnavailable as err:
+            raise RenderError("角色渲染服务暂不可用", 503) from err
+        except Exception as err:
+            raise RenderError("角色渲染失败", 500) from err
+        try:
+            webp = await get_or_init_transcoder().webp(data)
+        except TranscodeError as err:
+            raise RenderError(err.message, err.status) from err
+        key = self.image_key(self.signature(items))
+        await self.cache.set(key, webp, PyObj, ex=self.avatar_expire)
+        return webp
+
+    async def coalesce(self, serv: AvatarRenderer, items: list[MapleItem]) -> bytes:
+        """render the items, concurrent renders of the same outfit share one upstream call"""
+        signature = self.signature(items)
+        task = self._rendering.get(signature)
+        if task is None:
+            task = asyncio.ensure_future(self._render(serv, items))
+            self._rendering[signature] = task
+            task.add_done_callback(lambda _: self._rendering.pop(signature, None))
+        # a cancelled waiter must not cancel the render shared with the others
+        return await asyncio.shield(task)
+
+    async def render_items(self, serv: AvatarRenderer, items: list[MapleItem]) -> bytes:
+        """
+        Render the items, return webp format bytes
+        the image is cached under the signature of the items for avatar_expire seconds
+        :param serv: AvatarRenderer
+        :param items: the normalized items
+        :return: webp format bytes
+        """
+        data = await self.cache.get(self.image_key(self.signature(items)), serializer=PyObj)
+        if data:
+            return data
+        return await self.coalesce(serv, items)
+
+    async def cache_outfit(self, character_id: int, items: list[MapleItem]) -> None:
+        """cache the outfit of the character,
+        the outfit is also kept under its signature so that the avatar can be rendered by it
+        """
+        outfit = self.dumps_outfit(items)
+        await self.cache.set(self.pointer_key(character_id), outfit, PyObj, ex=self.pointer_expire)
+        await self.cache.set(
+            self.outfit_key(self.signature(items)), outfit, PyObj, ex=self.avatar_expire
+        )
+
+    async def load_outfit(self, character_id: int) -> list[MapleItem]:
+        """read the outfit of the character from the database and cache it"""
+        items = await self.outfit(character_id)
+        await self.cache_outfit(character_id, items)
+        return items
+
+    async def load_outfits(self, character_ids: list[int]) -> dict[int, list[MapleItem]]:
+        """read the outfits of a batch of characters by two queries and cache them,
+        characters that don't exist are omitted
+        """
+        if not character_ids:
+            return {}
+        chars = await Character.filter(id__in=character_ids).only("id", "skincolor", "hair", "face")
+        equips = await Character.equip_infos([c.id for c in chars])
+        outfits = {c.id: self.make_outfit(c, equips[c.id]) for c in chars}
+        await asyncio.gather(*(self.cache_outfit(i, items) for i, items in outfits.items()))
+        return outfits
+
+    async def character_outfit(self, character_id: int) -> list[MapleItem]:
+        """the outfit of the character, cached for pointer_expire seconds"""
+        if outfit := await self.cache.get(self.pointer_key(character_id), serializer=PyObj):
+            return self.loads_outfit(outfit.decode() if isinstance(outfit, bytes) else outfit)
+        return await self.load_outfit(character_id)
+
+    async def character_outfits(self, character_ids: list[int]) -> dict[int, list[MapleItem]]:
+        """the outfits of a batch of characters, the cached outfits are read by one MGET
+        characters that don't exist are omitted
+        """
+        character_ids = list(dict.fromkeys(character_ids))
+        pointers = await self.cache.get_many(
+            [self.pointer_key(i) for i in character_ids], serializer=PyObj
+        )
+        outfits: dict[int, list[MapleItem]] = {}
+        for character_id, outfit in zip(character_ids, pointers):
+            if outfit:
+                outfit = outfit.decode() if isinstance(outfit, bytes) else outfit
+                outfits[character_id] = self.loads_outfit(outfit)
+        outfits.update(await self.load_outfits([i for i in character_ids if i not in outfits]))
+        return {i: outfits[i] for i in character_ids if i in outfits}
+
+    async def render_character(self, serv: AvatarRenderer, character_id: int) -> bytes:
         """
         Render character photo, return webp format bytes
-        while the image initial render, the image data will be cached for 15 minutes
-        :param serv: MapleIoService
+        the image is rendered only when no character with the same outfit has been rendered
+        :param serv: AvatarRenderer
         :param character_id: character id
         :return: webp format bytes
         """
+        return await self.render_items(serv, await self.character_outfit(character_id))
 
-        async def get_image_data():
-            char = await Character.filter(id=character_id).first()
-            if not char:
-                raise RenderError("Character does not exist", 404)
-            equip = {
-                "Skin": f"200{char.skincolor}",
-                "Hair": str(char.hair),
-                "Face": str(char.face),
-                **{k: v.itemid for k, v in (await char.show_equip_info()).items()},
-            }
-            # When there is no weapon, the equipment is transparent by default to avoid rendering failure
-            equip["Weapon"] = equip.get("Weapon", "1702224")
-            equip = {k: v for k, v in equip.items() if v not in self.not_support_items}
-            items = [MapleItem(itemId=int(v)) for v in equip.values()]
+    async def render_signature(self, serv: AvatarRenderer, signature: str) -> Optional[bytes]:
+        """
+        Render the avatar by its signature, return webp format bytes
+        :param serv: AvatarRenderer
+        :param signature: the signature of an outfit
+        :return: None means the signature is unknown or its outfit has expired
+        """
+        if data := await self.cache.get(self.image_key(signature), serializer=PyObj):
+            return data
+        outfit = await self.cache.get(self.outfit_key(signature), serializer=PyObj)
+        if not outfit:
+            return None
+        items = self.loads_outfit(outfit.decode() if isinstance(outfit, bytes) else outfit)
+        return await self.coalesce(serv, items)
+
+    async def render_many(self, serv: AvatarRenderer, character_ids: list[int]) -> dict[int, bytes]:
+        """
+        Render a batch of characters, the cached outfits and images are read by one MGET each
+        :param serv: AvatarRenderer
+        :param character_ids: character ids
+        :return: character id -> webp format bytes, failed characters are omitted
+        """
+        outfits = await self.character_outfits(character_ids)
+        signatures = {i: self.signature(items) for i, items in outfits.items()}
+        unique = list(dict.fromkeys(signatures.values()))
+        images = await self.cache.get_many([self.image_key(s) for s in unique], serializer=PyObj)
+        images = dict(zip(unique, images))
+        renders = {s: outfits[i] for i, s in signatures.items() if not images[s]}
+        results = await asyncio.gather(
+            *(self.coalesce(serv, items) for items in renders.values()), return_exceptions=True
+        )
+        for signature, data in zip(renders, results):
+            if isinstance(data, RenderError):
+                continue
+            if isinstance(data, BaseException):
+                raise data
+            images[signature] = data
+        return {i: images[s] for i, s in signatures.items() if images[s]}
+
+    @staticmethod
+    def atlas_key(digest: str) -> str:
+        return f"Render:atlas:{digest}"
+
+    async def atlas_image(self, digest: str) -> Optional[bytes]:
+        return await self.cache.get(self.atlas_key(digest), serializer=PyObj)
+
+    async def atlas(
+        self, serv: AvatarRenderer, key: str, character_ids: list[int]
+    ) -> CharAtlasResponse:
+        """
+        Compose the avatars of the characters into one WEBP atlas
+        the offset map is cached under the key for atlas_expire seconds,
+        the image is kept twice as long so that a cached map never points to a missing image
+        :param serv: AvatarRenderer
+        :param key: the key of the page, e.g. the leaderboard version and the rank arguments
+        :param character_ids: character ids in the order of the page
+        """
+        map_key = f"Render:atlas:map:{key}"
+        serializer = Pydantic(CharAtlasResponse)
+        if m := await self.cache.get(map_key, serializer=serializer):
+            return m
+        images = await self.render_many(serv, character_ids)
+        ids = [i for i in dict.fromkeys(character_ids) if i in images]
+        m = CharAtlasResponse()
+        if ids:
             try:
-                data = await serv.character_avatar(items)
-            except Exception as err:
-                raise RenderError("角色渲染失败", 500) from err
-            with Image.open(io.BytesIO(data)) as img:
-                webp_buffer = io.BytesIO()
-                img.save(webp_buffer, format="WEBP")
-                webp_bytes = webp_buffer.getvalue()
-            return webp_bytes
-
-        key = f"Render:character_avatar:{character_id}"
-        return await self.cache.get_or_set(key, get_image_data, ex=900, serializer=PyObj)
+                webp, boxes, size = await get_or_init_transcoder().atlas(
+                    [images[i] for i in ids], settings.render.atlas_columns
+                )
+            except TranscodeError as err:
+                raise RenderError(err.message, err.status) from err
+            digest = hashlib.sha1(webp).hexdigest()
+            await self.cache.set(self.atlas_key(digest), webp, PyObj, ex=self.atlas_expire * 2)
+            m.image, (m.width, m.height) = digest, size
+            m.items = [
+                CharAtlasItem(character_id=i, x=x, y=y, width=w, height=h)
+                for i, (x, y, w, h) in zip(ids, boxes)
+            ]
+        await self.cache.set(map_key, m, serializer, ex=self.atlas_expire)
+        return m
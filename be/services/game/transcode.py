@@ -0,0 +1,214 @@
+"""头像转码池
+Pillow解码PNG、编码WEBP是CPU密集的同步操作，直接在协程中执行会阻塞事件循环，
+转码任务交给有界的进程池执行；sanic的worker是守护进程，不允许创建子进程，
+此时退回到线程池，Pillow的编解码器在执行时会释放GIL
+
+同时执行的转码不超过池的大小，排队的转码超过max_pending时直接拒绝，
+排队和转码的总时间超过timeout时放弃等待
+
+排行榜页面的头像合成为一张雪碧图(atlas)，合成同样在池中执行
+
+转码耗时和WEBP大小按编码参数记录到直方图，对比不同参数的取舍可以使用
+sanic inspect render_report sample=<PNG文件>
+"""
+
+import asyncio
+import io
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from PIL import Image
+
+from component.metrics import metrics
+from config import RenderConfig, settings
+
+__all__ = (
+    "TranscodeError",
+    "Transcoder",
+    "transcode",
+    "compose_atlas",
+    "compare_presets",
+    "get_or_init_transcoder",
+    "close_transcoder",
+)
+
+transcode_pending = metrics.gauge(
+    "avatar_transcode_pending", "Avatar transcodes waiting for or running in the pool"
+)
+transcode_total = metrics.counter("avatar_transcode_total", "Avatar transcodes", ("result",))
+transcode_seconds = metrics.histogram(
+    "avatar_transcode_seconds",
+    "Time spent by the pool on one avatar transcode",
+    ("preset",),
+    buckets=settings.metrics.latency_buckets,
+)
+transcode_bytes = metrics.histogram(
+    "avatar_transcode_bytes",
+    "Size of the transcoded WEBP avatars",
+    ("preset",),
+    buckets=settings.metrics.size_buckets,
+)
+
+# (x, y, width, height)
+Box = tuple[int, int, int, int]
+# (width, height)
+Size = tuple[int, int]
+
+
+class TranscodeError(Exception):
+    def __init__(self, message: str, status: int):
+        self.message = message
+        self.status = status
+
+
+def preset_name(quality: int, method: int, lossless: bool) -> str:
+    return f"lossless-m{method}" if lossless else f"q{quality}-m{method}"
+
+
+def transcode(data: bytes, quality: int, method: int, lossless: bool) -> tuple[bytes, float]:
+    """decode the image and encode it as WEBP, runs in the pool
+    :return: the WEBP bytes and the seconds spent
+    """
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as img:
+        buffer = io.BytesIO()
+        img.save(buffer, format="WEBP", quality=quality, method=method, lossless=lossless)
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+def compose_atlas(
+    images: list[bytes], columns: int, quality: int, method: int, lossless: bool
+) -> tuple[bytes, list[Box], Size, float]:
+    """place the images on a grid of equal cells and encode it as WEBP, runs in the pool
+    each image is centered horizontally and aligned to the bottom of its cell
+    :return: the WEBP bytes, the box of each image, the size of the atlas and the seconds spent
+    """
+    start = time.perf_counter()
+    decoded = []
+    for data in images:
+        with Image.open(io.BytesIO(data)) as img:
+            decoded.append(img.convert("RGBA"))
+    columns = max(min(columns, len(decoded)), 1)
+    cell_w = max((img.width for img in decoded), default=1)
+    cell_h = max((img.height for img in decoded), default=1)
+    rows = max(-(-len(decoded) // columns), 1)
+    atlas = Image.new("RGBA", (cell_w * columns, cell_h * rows), (0, 0, 0, 0))
+    boxes = []
+    for i, img in enumerate(decoded):
+        row, column = divmod(i, columns)
+        x = column * cell_w + (cell_w - img.width) // 2
+        y = row * cell_h + cell_h - img.height
+        atlas.paste(img, (x, y))
+        boxes.append((x, y, img.width, img.height))
+    buffer = io.BytesIO()
+    atlas.save(buffer, format="WEBP", quality=quality, method=method, lossless=lossless)
+    return buffer.getvalue(), boxes, atlas.size, time.perf_counter() - start
+
+
+def compare_presets(
+    data: bytes, presets: Iterable[tuple[int, int, bool]], rounds: int = 3
+) -> list[dict]:
+    """the size and the latency of the image encoded with each (quality, method, lossless)"""
+    report = []
+    for quality, method, lossless in presets:
+        seconds = []
+        for _ in range(rounds):
+            webp, spent = transcode(data, quality, method, lossless)
+            seconds.append(spent)
+        report.append(
+            {
+                "preset": preset_name(quality, method, lossless),
+                "bytes": len(webp),
+                "ratio": round(len(webp) / len(data), 3),
+                "seconds": round(min(seconds), 4),
+            }
+        )
+    return report
+
+
+class Transcoder:
+    """头像转码池
+
+    :param conf: 池大小、排队上限、超时时间与WEBP编码参数
+    """
+
+    def __init__(self, conf: RenderConfig):
+        self.conf = conf
+        self.preset = preset_name(conf.quality, conf.method, conf.lossless)
+        self.executor = self.create_executor(conf.workers)
+        self.semaphore = asyncio.Semaphore(conf.workers)
+        self.pending = 0
+
+    @staticmethod
+    def create_executor(workers: int) -> Executor:
+        if multiprocessing.current_process().daemon:
+            # daemonic processes are not allowed to have children
+            return ThreadPoolExecutor(workers, thread_name_prefix="transcode")
+        return ProcessPoolExecutor(workers)
+
+    async def _run(self, fn: Callable, *args):
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, fn, *args)
+
+    async def submit(self, fn: Callable, *args):
+        """run the function in the pool, fn must be picklable"""
+        if self.pending >= self.conf.workers + self.conf.max_pending:
+            transcode_total.inc("rejected")
+            raise TranscodeError("渲染繁忙，请稍后再试", 503)
+        self.pending += 1
+        transcode_pending.inc()
+        try:
+            result = await asyncio.wait_for(self._run(fn, *args), self.conf.timeout)
+        except asyncio.TimeoutError:
+            transcode_total.inc("timeout")
+            raise TranscodeError("角色渲染超时", 504)
+        except Exception as err:
+            transcode_total.inc("error")
+            raise TranscodeError("角色渲染失败", 500) from err
+        finally:
+            self.pending -= 1
+            transcode_pending.dec()
+        transcode_total.inc("ok")
+        return result
+
+    async def webp(self, data: bytes) -> bytes:
+        """transcode the image to WEBP in the pool"""
+        conf = self.conf
+        webp, spent = await self.submit(transcode, data, conf.quality, conf.method, conf.lossless)
+        transcode_seconds.observe(self.preset, value=spent)
+        transcode_bytes.observe(self.preset, value=len(webp))
+        return webp
+
+    async def atlas(self, images: list[bytes], columns: int) -> tuple[bytes, list[Box], Size]:
+        """compose the images into one WEBP atlas in the pool"""
+        conf = self.conf
+        webp, boxes, size, spent = await self.submit(
+            compose_atlas, images, columns, conf.quality, conf.method, conf.lossless
+        )
+        transcode_seconds.observe(f"atlas-{self.preset}", value=spent)
+        transcode_bytes.observe(f"atlas-{self.preset}", value=len(webp))
+        return webp, boxes, size
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_transcoder: Optional[Transcoder] = None
+
+
+def get_or_init_transcoder(conf: Optional[RenderConfig] = None) -> Transcoder:
+    """the transcoder of the worker process"""
+    global _transcoder
+    if _transcoder is None:
+        _transcoder = Transcoder(conf or settings.render)
+    return _transcoder
+
+
+def close_transcoder():
+    global _transcoder
+    if _transcoder is not None:
+        _transcoder.shutdown()
+        _transcoder = None
@@ -0,0 +1,68 @@
+"""角色渲染测试
+使用 asset/sprites/stub 资源包在本地合成角色图像，不依赖maplestory.io
+
+在be目录下执行: python -m unittest discover -s tests -t .
+"""
+
+import io
+import os
+import unittest
+
+from PIL import Image
+
+from services.game.render import (
+    AvatarRenderer,
+    LocalSpriteRenderer,
+    MapleItem,
+    RenderError,
+    RenderService,
+)
+from services.game.transcode import close_transcoder
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB = os.path.join(BASE_DIR, "asset", "sprites", "stub")
+
+
+class FailingRenderer(AvatarRenderer):
+    name = "failing"
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def character_avatar(self, items: list[MapleItem]) -> bytes:
+        raise self.error
+
+
+class LocalSpriteRendererTest(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self):
+        close_transcoder()
+
+    async def test_render_stub_pack(self):
+        renderer = LocalSpriteRenderer(STUB)
+        items = [MapleItem(itemId=i) for i in (2000, 20000, 30000, 1040002, 1060002, 1302000)]
+        data = await renderer.character_avatar(items)
+        with Image.open(io.BytesIO(data)) as image:
+            self.assertEqual(image.format, "PNG")
+            self.assertEqual(image.size, renderer.canvas)
+            # the skin also draws its head, so the canvas is not transparent
+            self.assertIsNotNone(image.getbbox())
+
+    async def test_no_sprite(self):
+        renderer = LocalSpriteRenderer(STUB)
+        with self.assertRaises(RenderError) as ctx:
+            await renderer.character_avatar([MapleItem(itemId=1)])
+        self.assertEqual(ctx.exception.status, 500)
+
+    async def test_render_error_status(self):
+        # the status of a RenderError raised by the renderer is kept
+        service = RenderService()
+        with self.assertRaises(RenderError) as ctx:
+            await service._render(FailingRenderer(RenderError("渲染繁忙，请稍后再试", 503)), [])
+        self.assertEqual(ctx.exception.status, 503)
+        with self.assertRaises(RenderError) as ctx:
+            await service._render(FailingRenderer(ValueError()), [])
+        self.assertEqual(ctx.exception.status, 500)
+
+
+if __name__ == "__main__":
+    unittest.main()